@@ -10,21 +10,32 @@
     'depends': ['base', 'mail', 'crm', 'sale_management'],
     'data': [
         'security/ir.model.access.csv',
+        'data/ir_cron.xml',
+        'data/whatsapp_variable_rule_data.xml',
 
         # MUST be before the CRM view that references the action
         'wizard/reply_whatsapp_wizard_views.xml',
 
         'wizard/send_whatsapp_wizard_views.xml',
+        'wizard/whatsapp_broadcast_wizard_views.xml',
         'views/res_partner_actions.xml',
         'views/res_partner_views.xml',
         'views/whatsapp_views.xml',
+        'views/whatsapp_account_views.xml',
+        'views/whatsapp_conversation_views.xml',
+        'views/whatsapp_message_views.xml',
+        'views/whatsapp_response_report_views.xml',
+        'views/whatsapp_outbox_views.xml',
+        'views/whatsapp_webhook_inbox_views.xml',
+        'views/whatsapp_inbound_media_views.xml',
+        'views/whatsapp_variable_rule_views.xml',
 
         # after the action exists
         'views/crm_lead_views.xml',
 
         'views/sale_order_views.xml',
         'views/res_config_settings_views.xml',
-        #'views/assets.xml',
+        'views/assets.xml',
     ],
     'installable': True,
     'application': True,
@@ -0,0 +1,3 @@
+# -*- coding: utf-8 -*-
+# whatsapp_meta_integration/benchmarks/__init__.py
+# Not imported by the module itself: run from an Odoo shell, see harness.py.
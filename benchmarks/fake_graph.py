@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+# whatsapp_meta_integration/benchmarks/fake_graph.py
+"""
+Local stand-in for graph.facebook.com, enough of it for this module:
+/messages, /media upload, paginated /message_templates, the media
+metadata endpoint and media downloads. Latency and throttling (Meta error
+130429) can be injected. Standard library only, so it also runs without Odoo:
+
+    $ python3 fake_graph.py --port 8765 --latency 0.05 --throttle 0.02
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_MEDIA_SIZE = 256 * 1024
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+def make_template(index):
+    return {
+        'id': str(900000 + index),
+        'name': 'bench_template_%05d' % index,
+        'language': 'en_US',
+        'status': 'APPROVED',
+        'parameter_format': 'POSITIONAL',
+        'components': [
+            {'type': 'HEADER', 'format': 'TEXT', 'text': 'Order {{1}}', 'example': {'header_text': ['42']}},
+            {'type': 'BODY', 'text': 'Hello {{1}}, your order {{2}} ships on {{3}}.'},
+            {'type': 'FOOTER', 'text': 'Benchmark'},
+        ],
+    }
+
+
+class FakeGraphServer(object):
+    """
+    ``latency`` (seconds) is added to every response, ``throttle`` is the
+    share of /messages calls answered with a throughput error. Media ids
+    sharing the part before their last '.' download the same bytes, so
+    forwarded files can be simulated ('flyer.1', 'flyer.2', ...).
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, throttle=0.0, templates=0,
+                 media_size=DEFAULT_MEDIA_SIZE):
+        self.latency = latency
+        self.throttle = throttle
+        self.templates = [make_template(i) for i in range(templates)]
+        self.media_size = media_size
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._media = {}
+        self._httpd = _ThreadingHTTPServer((host, port), self._handler_class())
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return 'http://%s:%s' % (host, port)
+
+    def set_templates(self, count):
+        self.templates = [make_template(i) for i in range(count)]
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name='fake-graph', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def media_bytes(self, media_id):
+        key = media_id.rsplit('.', 1)[0]
+        with self._lock:
+            if key not in self._media:
+                seed = hashlib.sha256(key.encode()).digest()
+                self._media[key] = (seed * (self.media_size // len(seed) + 1))[:self.media_size]
+            return self._media[key]
+
+    # ---------- request handling ----------
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep-alive, as graph.facebook.com
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body, content_type='application/json'):
+                if not isinstance(body, bytes):
+                    body = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _drain_body(self):
+                remaining = int(self.headers.get('Content-Length') or 0)
+                while remaining > 0:
+                    chunk = self.rfile.read(min(remaining, 65536))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+
+            def _route(self, method):
+                if server.latency:
+                    time.sleep(server.latency)
+                url = urlparse(self.path)
+                parts = [p for p in url.path.split('/') if p]
+                if method == 'POST':
+                    self._drain_body()
+                if parts[:1] == ['download'] and method == 'GET':
+                    server.count('GET download')
+                    return self._reply(200, server.media_bytes(parts[1]), 'application/octet-stream')
+                if len(parts) == 3 and parts[2] == 'messages' and method == 'POST':
+                    if server.throttle and random.random() < server.throttle:
+                        server.count('POST messages throttled')
+                        return self._reply(400, {'error': {'code': 130429, 'message': '(#130429) Rate limit hit'}})
+                    server.count('POST messages')
+                    return self._reply(200, {'messaging_product': 'whatsapp',
+                                             'messages': [{'id': 'wamid.%s' % uuid.uuid4().hex}]})
+                if len(parts) == 3 and parts[2] == 'media' and method == 'POST':
+                    server.count('POST media')
+                    return self._reply(200, {'id': 'media-%s' % uuid.uuid4().hex})
+                if len(parts) == 3 and parts[2] == 'message_templates' and method == 'GET':
+                    server.count('GET message_templates')
+                    query = parse_qs(url.query)
+                    limit = int(query.get('limit', ['100'])[0])
+                    offset = int(query.get('after', ['0'])[0])
+                    page = server.templates[offset:offset + limit]
+                    body = {'data': page, 'paging': {'cursors': {'after': str(offset + len(page))}}}
+                    if offset + limit < len(server.templates):
+                        body['paging']['next'] = '%s%s?limit=%s&after=%s' % (
+                            server.base_url, url.path, limit, offset + limit)
+                    return self._reply(200, body)
+                if len(parts) == 2 and method == 'GET':
+                    server.count('GET media info')
+                    content = server.media_bytes(parts[1])
+                    return self._reply(200, {
+                        'url': '%s/download/%s' % (server.base_url, parts[1]),
+                        'mime_type': 'image/jpeg',
+                        'sha256': hashlib.sha256(content).hexdigest(),
+                        'file_size': len(content),
+                        'id': parts[1],
+                    })
+                server.count('%s unknown' % method)
+                return self._reply(404, {'error': {'code': 100, 'message': 'Unknown path %s' % url.path}})
+
+            def do_GET(self):
+                self._route('GET')
+
+            def do_POST(self):
+                self._route('POST')
+
+        return Handler
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument('--throttle', type=float, default=0.0, help="share of sends answered with 130429")
+    parser.add_argument('--templates', type=int, default=0)
+    args = parser.parse_args()
+    fake = FakeGraphServer(args.host, args.port, args.latency, args.throttle, args.templates)
+    print("Fake Graph API on %s (set whatsapp_meta.graph_url to it)" % fake.base_url)
+    try:
+        fake._httpd.serve_forever()
+    except KeyboardInterrupt:
+        fake.stop()
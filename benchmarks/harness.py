@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+# whatsapp_meta_integration/benchmarks/harness.py
+"""
+Throughput benchmarks for the module's hot paths, against a local fake
+Graph API (see fake_graph.py). Run from an Odoo shell on a database where
+the module is installed:
+
+    $ odoo-bin shell -d <db>
+    >>> from odoo.addons.whatsapp_meta_integration.benchmarks import harness
+    >>> harness.run(env, leads=2000, latency=0.05, throttle=0.01)
+
+Every scenario runs in the shell's transaction with the crons' intermediate
+commits disabled, and everything is rolled back at the end (only files
+downloaded to the filestore remain, for the attachment GC to collect).
+For each scenario the report gives operations, ops/s, p50/p99 latency per
+operation, SQL queries on the main cursor and the process peak RSS.
+"""
+import base64
+import hashlib
+import logging
+import os
+import random
+import resource
+import threading
+import time
+import uuid
+
+from odoo import fields
+
+from .fake_graph import FakeGraphServer
+
+_logger = logging.getLogger(__name__)
+
+BENCH_PHONE_NUMBER_ID = 'bench-phone-number'
+BENCH_WABA_ID = 'bench-waba'
+
+
+def _percentile(values, share):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * share), len(values) - 1)]
+
+
+class Bench(object):
+
+    def __init__(self, env, fake):
+        self.env = env
+        self.fake = fake
+        self.results = []
+
+    def measure(self, name, func, ops=None):
+        """Run ``func`` and record its numbers. ``func`` returns one latency per
+        operation, or for batch jobs (crons) pass the number of ``ops`` it handles:
+        their latency is then the average time per operation."""
+        cr = self.env.cr
+        queries = cr.sql_log_count
+        requests_before = sum(self.fake.stats.values())
+        started = time.time()
+        latencies = func()
+        elapsed = time.time() - started
+        if ops is not None:
+            latencies = [elapsed / ops] * ops if ops else []
+        self.results.append({
+            'scenario': name,
+            'ops': len(latencies),
+            'seconds': elapsed,
+            'ops_per_s': len(latencies) / elapsed if elapsed else 0.0,
+            'p50_ms': _percentile(latencies, 0.50) * 1000,
+            'p99_ms': _percentile(latencies, 0.99) * 1000,
+            'queries': cr.sql_log_count - queries,
+            'api_calls': sum(self.fake.stats.values()) - requests_before,
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+        })
+        _logger.info("Benchmark %s: %s", name, self.results[-1])
+
+    @staticmethod
+    def timed(calls):
+        """Run each callable and return their latencies."""
+        latencies = []
+        for call in calls:
+            started = time.time()
+            call()
+            latencies.append(time.time() - started)
+        return latencies
+
+    def report(self):
+        header = ('scenario', 'ops', 'seconds', 'ops_per_s', 'p50_ms', 'p99_ms', 'queries', 'api_calls', 'peak_rss_mb')
+        lines = ['  '.join('%14s' % column for column in header)]
+        for result in self.results:
+            lines.append('  '.join(
+                '%14s' % (('%.2f' % result[column]) if isinstance(result[column], float) else result[column])
+                for column in header))
+        lines.append("Fake Graph API calls: %s" % dict(self.fake.stats))
+        return '\n'.join(lines)
+
+
+# ---------- dataset ----------
+def _setup(env, fake):
+    """Point the module at the fake server with a single, unthrottled account."""
+    ICP = env['ir.config_parameter'].sudo()
+    ICP.set_param('whatsapp_meta.graph_url', fake.base_url)
+    ICP.set_param('whatsapp_meta.messages_per_second', 100000)
+    Account = env['whatsapp.account'].sudo()
+    Account.search([]).write({'active': False})
+    account = Account.create({
+        'name': 'Benchmark',
+        'access_token': 'bench-token-%s' % uuid.uuid4().hex,
+        'phone_number_id': BENCH_PHONE_NUMBER_ID,
+        'waba_id': BENCH_WABA_ID,
+    })
+    template = env['whatsapp.template'].create({
+        'name': 'bench_send',
+        'language_code': 'en_US',
+        'body_text': 'Hello {{1}}, your order {{2}} ships on {{3}}.',
+        'variable_count': 3,
+        'components_json': '[{"type": "BODY", "text": "Hello {{1}}, your order {{2}} ships on {{3}}."}]',
+    })
+    return account, template
+
+
+def _seed(env, leads):
+    """Partners with a mobile number and one lead each; numbers are returned
+    without '+', as webhooks send them."""
+    numbers = ['2010%08d' % i for i in range(leads)]
+    partners = env['res.partner'].create([
+        {'name': 'Bench Customer %s' % i, 'mobile': '+' + number} for i, number in enumerate(numbers)
+    ])
+    env['crm.lead'].create([
+        {'name': 'Bench Lead %s' % i, 'partner_id': partner.id, 'type': 'opportunity'}
+        for i, partner in enumerate(partners)
+    ])
+    return numbers
+
+
+def _webhook_payload(fake, numbers, size, unknown_share=0.1, media_share=0.1):
+    messages = []
+    for _i in range(size):
+        number = random.choice(numbers) if random.random() > unknown_share else '2019%08d' % random.randint(0, 10 ** 8)
+        message = {'from': number, 'id': 'wamid.in.%s' % uuid.uuid4().hex,
+                   'timestamp': str(int(time.time())), 'type': 'text', 'text': {'body': 'Hello there'}}
+        if random.random() < media_share:
+            # Few distinct files: most are forwards of the same flyer
+            media_id = 'flyer%s.%s' % (random.randint(0, 4), uuid.uuid4().hex)
+            # Meta sends the digest base64-encoded
+            sha256 = base64.b64encode(hashlib.sha256(fake.media_bytes(media_id)).digest()).decode()
+            message.update(type='image', image={'id': media_id, 'mime_type': 'image/jpeg', 'sha256': sha256})
+            del message['text']
+        messages.append(message)
+    return {'object': 'whatsapp_business_account', 'entry': [{'id': BENCH_WABA_ID, 'changes': [{
+        'field': 'messages',
+        'value': {'messaging_product': 'whatsapp',
+                  'metadata': {'phone_number_id': BENCH_PHONE_NUMBER_ID},
+                  'messages': messages},
+    }]}]}
+
+
+def _status_payload(wamids, status):
+    return {'object': 'whatsapp_business_account', 'entry': [{'id': BENCH_WABA_ID, 'changes': [{
+        'field': 'messages',
+        'value': {'messaging_product': 'whatsapp',
+                  'metadata': {'phone_number_id': BENCH_PHONE_NUMBER_ID},
+                  'statuses': [{'id': wamid, 'status': status, 'timestamp': str(int(time.time())),
+                                'recipient_id': '201000000000'} for wamid in wamids]},
+    }]}]}
+
+
+# ---------- scenarios ----------
+def bench_webhook(bench, numbers, payloads=200, batch=20):
+    """Webhook intake (what the POST route does) then the inbox cron."""
+    env = bench.env
+    Inbox = env['whatsapp.webhook.inbox'].sudo()
+    bodies = [_webhook_payload(bench.fake, numbers, batch) for _i in range(payloads)]
+    bench.measure('webhook intake', lambda: bench.timed(
+        [lambda body=body: Inbox._enqueue_payload(body) for body in bodies]))
+    bench.measure('inbox processing', lambda: Inbox._cron_process_inbox(max_batches=10 ** 6),
+                  ops=payloads * batch)
+    Media = env['whatsapp.inbound.media'].sudo()
+    bench.measure('inbound media', Media._cron_download, ops=Media.search_count([('state', '=', 'pending')]))
+
+
+def bench_send_template(bench, template, count):
+    """Send Template wizard on leads, then draining the outbox."""
+    env = bench.env
+    leads = env['crm.lead'].search([('name', '=like', 'Bench Lead %')], limit=count)
+
+    def send(lead):
+        wizard = env['send.whatsapp.wizard'].with_context(active_model='crm.lead', active_id=lead.id).create({
+            'template_id': template.id,
+            'partner_id': lead.partner_id.id,
+            'to_number': lead.partner_id.mobile,
+            'variable_ids': [(0, 0, {'sequence': i, 'name': str(i), 'value': 'value %s' % i}) for i in (1, 2, 3)],
+        })
+        wizard.action_send_message()
+
+    bench.measure('send template', lambda: bench.timed([lambda lead=lead: send(lead) for lead in leads]))
+    _drain(bench, 'outbox (templates)')
+
+
+def bench_reply_attachments(bench, count, attachments, size):
+    """Reply wizard with ``attachments`` distinct files each, then draining the outbox."""
+    env = bench.env
+    leads = env['crm.lead'].search([('name', '=like', 'Bench Lead %')], limit=count)
+    leads.write({'last_wa_inbound': fields.Datetime.now()})
+
+    def reply(lead):
+        files = env['ir.attachment'].create([{
+            'name': 'bench-%s.pdf' % i, 'mimetype': 'application/pdf', 'datas': base64.b64encode(os.urandom(size)),
+        } for i in range(attachments)])
+        wizard = env['whatsapp.reply.wizard'].with_context(default_lead_id=lead.id).create({
+            'message': 'Here are your documents',
+            'attachment_ids': [(6, 0, files.ids)],
+        })
+        wizard.action_send()
+
+    bench.measure('reply + %s files' % attachments, lambda: bench.timed([lambda lead=lead: reply(lead) for lead in leads]))
+    _drain(bench, 'outbox (replies)')
+
+
+def _drain(bench, name):
+    Outbox = bench.env['whatsapp.outbox'].sudo()
+    bench.measure(name, lambda: Outbox._cron_process_queue(time_budget=3600),
+                  ops=Outbox.search_count([('state', '=', 'queued')]))
+    sent = Outbox.search([('state', '=', 'sent'), ('wa_message_id', '!=', False)], limit=500)
+    if sent:
+        Inbox = bench.env['whatsapp.webhook.inbox'].sudo()
+        for status in ('sent', 'delivered', 'read'):
+            Inbox._enqueue_payload(_status_payload(sent.mapped('wa_message_id'), status))
+        bench.measure('status webhooks', lambda: Inbox._cron_process_inbox(max_batches=10 ** 6),
+                      ops=3 * len(sent))
+
+
+def bench_template_sync(bench, templates):
+    env = bench.env
+    bench.fake.set_templates(templates)
+    settings = env['res.config.settings'].create({})
+    bench.measure('template sync (new)', settings.action_sync_templates, ops=templates)
+    bench.measure('template sync (same)', settings.action_sync_templates, ops=templates)
+
+
+def run(env, leads=1000, sends=500, replies=50, attachments=3, attachment_size=200 * 1024,
+        templates=3000, webhook_payloads=200, webhook_batch=20, latency=0.0, throttle=0.0):
+    """Run every scenario, print the report and return the results. Nothing is committed."""
+    thread = threading.currentThread()
+    testing = getattr(thread, 'testing', False)
+    thread.testing = True  # the crons skip their intermediate commits
+    fake = FakeGraphServer(latency=latency, throttle=throttle).start()
+    try:
+        _setup(env, fake)
+        numbers = _seed(env, leads)
+        bench = Bench(env, fake)
+        bench_webhook(bench, numbers, webhook_payloads, webhook_batch)
+        bench_send_template(bench, env['whatsapp.template'].search([('name', '=', 'bench_send')], limit=1),
+                            min(sends, leads))
+        bench_reply_attachments(bench, min(replies, leads), attachments, attachment_size)
+        bench_template_sync(bench, templates)
+        print(bench.report())
+        return bench.results
+    finally:
+        env.cr.rollback()
+        env.clear()
+        thread.testing = testing
+        fake.stop()
+        # The rate limiter commits on its own cursor
+        with env.registry.cursor() as cr:
+            cr.execute("DELETE FROM whatsapp_rate_limit WHERE key = %s", (BENCH_PHONE_NUMBER_ID,))
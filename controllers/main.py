@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
+import hmac
 import logging
 import json
-from odoo import http, fields, _
+from odoo import http, _
 from odoo.http import request
 
+from ..tools import metrics
+
 _logger = logging.getLogger(__name__)
 
 
@@ -11,88 +14,58 @@ class WhatsAppWebhook(http.Controller):
     """
     Minimal webhook handler:
     - GET: Meta verification (hub.challenge)
-    - POST: Incoming messages -> update crm.lead.last_wa_inbound
-    NOTE: Adapt the sender-to-lead resolution to your data model if needed.
+    - POST: Incoming events -> whatsapp.webhook.inbox (processed later by a cron,
+      which updates crm.lead.last_wa_inbound)
     """
 
     @http.route(['/whatsapp/webhook'], type='http', auth='public', methods=['GET'], csrf=False)
     def webhook_verify(self, **params):
-        token_expected = request.env['ir.config_parameter'].sudo().get_param('whatsapp.verify_token') or ''
+        ICP = request.env['ir.config_parameter'].sudo()
+        tokens_expected = set(request.env['whatsapp.account'].sudo().search([]).mapped('verify_token'))
+        tokens_expected.update([ICP.get_param('whatsapp_meta.verify_token'), ICP.get_param('whatsapp.verify_token')])
         mode = params.get('hub.mode')
         token = params.get('hub.verify_token')
         challenge = params.get('hub.challenge')
-        if mode == 'subscribe' and token and token == token_expected:
+        if mode == 'subscribe' and token and token in tokens_expected:
             return challenge or ''
         return http.Response("Forbidden", status=403)
 
-    @http.route(['/whatsapp/webhook'], type='json', auth='public', methods=['POST'], csrf=False)
-    def webhook_receive(self, **payload):
-        try:
-            data = request.jsonrequest or {}
-            self._handle_incoming(data)
-        except Exception as e:
-            _logger.exception("WA webhook error: %s", e)
-        return {"status": "ok"}
-
-    # ------------------ helpers ------------------
-
-    def _handle_incoming(self, data):
-        """
-        Parse the Cloud API webhook and touch last_wa_inbound on the matched lead.
-        This covers text & media messages in 'messages' list.
-        """
-        entries = data.get('entry', [])
-        for entry in entries:
-            changes = entry.get('changes', [])
-            for change in changes:
-                value = change.get('value', {})
-                contacts = value.get('contacts') or []
-                messages = value.get('messages') or []
-                if not messages:
-                    continue
-
-                # Sender phone in E.164 (e.g., +2010xxxx)
-                sender = messages[0].get('from')  # string
-                if not sender:
-                    continue
-
-                self._touch_lead_from_phone(sender)
-
-    def _touch_lead_from_phone(self, e164):
-        """
-        Find the active lead for this phone and update last_wa_inbound = now().
-        Strategy:
-          - Find partner by phone/mobile matching the last 9-12 digits
-          - Then find the most recent open lead for that partner
-        Adjust as per your data quality.
-        """
-        env = request.env
-        Partner = env['res.partner'].sudo()
-        Lead = env['crm.lead'].sudo()
-
-        # Try strict match first (full E.164)
-        partner = Partner.search([('mobile', '=', e164)], limit=1)
-        if not partner:
-            partner = Partner.search([('phone', '=', e164)], limit=1)
-
-        # Fallback: loose tail match (e.g., last 10 digits)
-        if not partner and e164 and e164.startswith('+') and len(e164) > 6:
-            tail = e164[-10:]
-            partner = Partner.search(['|', ('mobile', 'ilike', tail), ('phone', 'ilike', tail)], limit=1)
-
-        lead = None
-        if partner:
-            lead = Lead.search([('partner_id', '=', partner.id)], order='create_date desc', limit=1)
-        else:
-            # As a last resort, try lead phone fields
-            lead = Lead.search(['|', ('mobile', '=', e164), ('phone', '=', e164)], order='create_date desc', limit=1)
-            if not lead and e164 and len(e164) > 6:
-                tail = e164[-10:]
-                lead = Lead.search(['|', ('mobile', 'ilike', tail), ('phone', 'ilike', tail)], order='create_date desc', limit=1)
+    @http.route(['/whatsapp/webhook'], type='http', auth='public', methods=['POST'], csrf=False)
+    def webhook_receive(self, **params):
+        """Store the events, answering 2xx only once they are stored: on any
+        other answer Meta delivers the payload again."""
+        with metrics.timer('whatsapp_webhook_seconds'):
+            body = request.httprequest.get_data() or b''
+            metrics.observe('whatsapp_webhook_payload_bytes', len(body))
+            try:
+                data = json.loads(body.decode('utf-8') or '{}')
+            except ValueError:
+                return self._json_response({"status": "invalid payload"}, status=400)
+            try:
+                request.env['whatsapp.webhook.inbox'].sudo()._enqueue_payload(data)
+            except Exception as e:
+                _logger.exception("WA webhook error: %s", e)
+                request.env.cr.rollback()
+                return self._json_response({"status": "error"}, status=503)
+            try:
+                with request.env.cr.savepoint():
+                    request.env['whatsapp.metrics.snapshot'].sudo()._flush()
+            except Exception:
+                _logger.exception("WA webhook: could not store metrics")
+        return self._json_response({"status": "ok"})
 
-        if lead:
-            lead.write({'last_wa_inbound': fields.Datetime.now()})
-            _logger.info("Updated last_wa_inbound on lead %s for %s", lead.id, e164)
-        else:
-            _logger.info("No lead matched for inbound WA from %s", e164)
+    @staticmethod
+    def _json_response(data, status=200):
+        return http.Response(json.dumps(data), status=status, headers=[('Content-Type', 'application/json')])
 
+    @http.route(['/whatsapp/metrics'], type='http', auth='public', methods=['GET'], csrf=False)
+    def prometheus_metrics(self, **params):
+        """Prometheus scrape endpoint, enabled by setting whatsapp_meta.metrics_token;
+        send it as a bearer token (or ``?token=``)."""
+        expected = request.env['ir.config_parameter'].sudo().get_param('whatsapp_meta.metrics_token') or ''
+        auth = request.httprequest.headers.get('Authorization') or ''
+        token = auth[7:] if auth.startswith('Bearer ') else params.get('token') or ''
+        if not expected or not hmac.compare_digest(token, expected):
+            return http.Response("Forbidden", status=403)
+        body = request.env['whatsapp.metrics.snapshot'].sudo()._render()
+        return http.Response(body, headers=[('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')])
@@ -1,6 +1,19 @@
 #Author: Noureldin ElDehy
 # whatsapp_meta_integration/models/__init__.py
+from . import whatsapp_phone_mixin
 from . import res_config_settings
 from . import res_partner
 from . import whatsapp_template
-from . import crm_lead
\ No newline at end of file
+from . import crm_lead
+from . import sale_order
+from . import whatsapp_outbox
+from . import whatsapp_webhook_inbox
+from . import whatsapp_rate_limit
+from . import whatsapp_media
+from . import whatsapp_variable_rule
+from . import whatsapp_account
+from . import whatsapp_message
+from . import whatsapp_conversation
+from . import whatsapp_response_report
+from . import whatsapp_inbound_media
+from . import whatsapp_metrics
@@ -1,59 +1,127 @@
 # -*- coding: utf-8 -*-
-from datetime import timedelta
-from odoo import api, fields, models
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError
+from odoo.tools.sql import column_exists, create_column
+
+from ..tools import metrics
+from ..tools.phone import phone_key
+
+_logger = logging.getLogger(__name__)
+
+REPLY_WINDOW_HOURS = 24
+REPLY_WINDOW_EXPIRING_HOURS = 4
+# Fields the lead form re-reads on a live update (see static/src/js/form_view_reload.js)
+LIVE_FIELDS = ['last_wa_inbound', 'reply_window_deadline', 'reply_window_open',
+               'reply_window_expiring_soon', 'reply_window_remaining_text']
 
 class CrmLead(models.Model):
-    _inherit = 'crm.lead'
+    _name = 'crm.lead'
+    _inherit = ['crm.lead', 'whatsapp.phone.mixin']
 
     # Updated by webhook on inbound WhatsApp
     last_wa_inbound = fields.Datetime(string="Last WA inbound")
 
-    # Computed window status + deadline + remaining text
+    # Stored + indexed deadline so leads can be filtered/sorted in SQL;
+    # the open flag and remaining text are derived from it at read time.
+    reply_window_deadline = fields.Datetime(
+        string='WA reply deadline',
+        compute='_compute_reply_window_deadline',
+        store=True,
+        index=True,
+    )
     reply_window_open = fields.Boolean(
         string='WA 24h Window Open',
         compute='_compute_reply_window_fields',
-        store=False,
+        search='_search_reply_window_open',
     )
-    reply_window_deadline = fields.Datetime(
-        string='WA reply deadline',
+    reply_window_expiring_soon = fields.Boolean(
+        string='WA Window Expiring Soon',
         compute='_compute_reply_window_fields',
-        store=False,
+        search='_search_reply_window_expiring_soon',
     )
     reply_window_remaining_text = fields.Char(
         string='Time left to reply',
         compute='_compute_reply_window_fields',
-        store=False,
     )
 
+    def _auto_init(self):
+        # Create and fill the deadline column in SQL rather than letting the
+        # ORM recompute it lead by lead on install.
+        cr = self.env.cr
+        if not column_exists(cr, self._table, 'reply_window_deadline'):
+            create_column(cr, self._table, 'reply_window_deadline', 'timestamp')
+            cr.execute("""
+                UPDATE crm_lead
+                   SET reply_window_deadline = last_wa_inbound + interval '1 hour' * %s
+                 WHERE last_wa_inbound IS NOT NULL
+            """, (REPLY_WINDOW_HOURS,))
+        return super()._auto_init()
+
     @api.depends('last_wa_inbound')
+    def _compute_reply_window_deadline(self):
+        for lead in self:
+            lead.reply_window_deadline = lead.last_wa_inbound + timedelta(hours=REPLY_WINDOW_HOURS) \
+                if lead.last_wa_inbound else False
+
+    @api.depends('reply_window_deadline')
     def _compute_reply_window_fields(self):
         now = fields.Datetime.now()
+        soon = now + timedelta(hours=REPLY_WINDOW_EXPIRING_HOURS)
         for lead in self:
-            deadline = None
-            open_flag = False
+            deadline = lead.reply_window_deadline
+            open_flag = bool(deadline) and now <= deadline
             remaining_text = "Expired"
 
-            if lead.last_wa_inbound:
-                deadline = lead.last_wa_inbound + timedelta(hours=24)
-                open_flag = now <= deadline
-                if open_flag:
-                    delta = deadline - now
-                    secs = int(delta.total_seconds())
-                    hours = secs // 3600
-                    mins = (secs % 3600) // 60
-                    if hours and mins:
-                        remaining_text = f"{hours}h {mins}m left"
-                    elif hours:
-                        remaining_text = f"{hours}h left"
-                    elif mins:
-                        remaining_text = f"{mins}m left"
-                    else:
-                        remaining_text = "Under 1m left"
-
-            lead.reply_window_deadline = deadline
+            if open_flag:
+                delta = deadline - now
+                secs = int(delta.total_seconds())
+                hours = secs // 3600
+                mins = (secs % 3600) // 60
+                if hours and mins:
+                    remaining_text = f"{hours}h {mins}m left"
+                elif hours:
+                    remaining_text = f"{hours}h left"
+                elif mins:
+                    remaining_text = f"{mins}m left"
+                else:
+                    remaining_text = "Under 1m left"
+
             lead.reply_window_open = open_flag
+            lead.reply_window_expiring_soon = open_flag and deadline <= soon
             lead.reply_window_remaining_text = remaining_text
 
+    def _search_reply_window_open(self, operator, value):
+        if operator not in ('=', '!='):
+            raise UserError(_("Operation not supported."))
+        now = fields.Datetime.now()
+        if (operator == '=') == bool(value):
+            return [('reply_window_deadline', '>=', now)]
+        return ['|', ('reply_window_deadline', '=', False), ('reply_window_deadline', '<', now)]
+
+    def _search_reply_window_expiring_soon(self, operator, value):
+        if operator not in ('=', '!='):
+            raise UserError(_("Operation not supported."))
+        now = fields.Datetime.now()
+        soon = now + timedelta(hours=REPLY_WINDOW_EXPIRING_HOURS)
+        if (operator == '=') == bool(value):
+            return [('reply_window_deadline', '>=', now), ('reply_window_deadline', '<=', soon)]
+        return ['|', '|',
+                ('reply_window_deadline', '=', False),
+                ('reply_window_deadline', '<', now),
+                ('reply_window_deadline', '>', soon)]
+
+    def write(self, vals):
+        res = super().write(vals)
+        if 'user_id' in vals:
+            # The inbox follows the lead's salesperson
+            self.env['whatsapp.conversation'].sudo().search([('lead_id', 'in', self.ids)]).write(
+                {'user_id': vals['user_id']})
+        return res
+
     def action_open_whatsapp_reply_wizard(self):
         """Open the Reply wizard (free-form only allowed inside 24h)."""
         self.ensure_one()
@@ -75,3 +143,175 @@ class CrmLead(models.Model):
             },
         }
 
+
+    # ---------- inbound webhook ----------
+    @api.model
+    def _wa_match_leads(self, numbers):
+        """
+        Resolve sender numbers to leads with a fixed number of queries.
+        A sender matching a partner goes to that partner's newest lead;
+        senders matching no partner are looked up on the lead's own numbers.
+        Returns {number: lead_id} for the numbers that matched.
+        """
+        cr = self.env.cr
+        started = time.time()
+        key_by_number = {number: phone_key(number) for number in numbers}
+        keys = list({key for key in key_by_number.values() if key})
+        if not keys:
+            return {}
+
+        # 1) partners -> their newest active lead
+        cr.execute("""
+            SELECT id, wa_mobile_key, wa_phone_key
+              FROM res_partner
+             WHERE active AND (wa_mobile_key = ANY(%s) OR wa_phone_key = ANY(%s))
+        """, (keys, keys))
+        partners_by_key = {}
+        for partner_id, mobile_key, phone_key_ in cr.fetchall():
+            for key in {mobile_key, phone_key_}:
+                if key:
+                    partners_by_key.setdefault(key, []).append(partner_id)
+
+        lead_by_key = {}
+        partner_ids = [pid for pids in partners_by_key.values() for pid in pids]
+        if partner_ids:
+            cr.execute("""
+                SELECT DISTINCT ON (partner_id) partner_id, id, create_date
+                  FROM crm_lead
+                 WHERE active AND partner_id = ANY(%s)
+              ORDER BY partner_id, create_date DESC
+            """, (partner_ids,))
+            newest = {partner_id: (create_date, lead_id) for partner_id, lead_id, create_date in cr.fetchall()}
+            for key, pids in partners_by_key.items():
+                candidates = [newest[pid] for pid in pids if pid in newest]
+                if candidates:
+                    lead_by_key[key] = max(candidates)[1]
+
+        # 2) no partner at all -> match the lead's own phone/mobile
+        lead_keys = [key for key in keys if key not in partners_by_key]
+        if lead_keys:
+            cr.execute("""
+                SELECT id, wa_mobile_key, wa_phone_key
+                  FROM crm_lead
+                 WHERE active AND (wa_mobile_key = ANY(%s) OR wa_phone_key = ANY(%s))
+              ORDER BY create_date DESC
+            """, (lead_keys, lead_keys))
+            for lead_id, mobile_key, phone_key_ in cr.fetchall():
+                for key in (mobile_key, phone_key_):
+                    if key and key not in partners_by_key:
+                        lead_by_key.setdefault(key, lead_id)
+
+        metrics.observe('whatsapp_lead_match_seconds', time.time() - started)
+        for key in key_by_number.values():
+            if key in lead_by_key:
+                strategy = 'partner' if key in partners_by_key else 'lead_number'
+            else:
+                strategy = 'partner_without_lead' if key in partners_by_key else 'unmatched'
+            metrics.inc('whatsapp_lead_matches_total', strategy=strategy)
+        return {number: lead_by_key[key] for number, key in key_by_number.items() if key in lead_by_key}
+
+    @api.model
+    def _wa_register_inbound(self, stamps):
+        """
+        Merge {lead_id: datetime} into last_wa_inbound with a single UPDATE.
+        The merge is a max: an older, late-processed message never moves the
+        window back, and leads already up to date are not written (nor locked).
+        Rows are locked in id order so concurrent batches cannot deadlock.
+        """
+        if not stamps:
+            return
+        values = ", ".join(["(%s, %s::timestamp)"] * len(stamps))
+        params = [item for lead_id, stamp in stamps.items() for item in (lead_id, stamp)]
+        self.env.cr.execute("""
+            WITH v(id, stamp) AS (VALUES {values}),
+                 locked AS (
+                    SELECT l.id FROM crm_lead l JOIN v ON v.id = l.id
+                     WHERE l.last_wa_inbound IS NULL OR l.last_wa_inbound < v.stamp
+                  ORDER BY l.id
+                       FOR UPDATE OF l
+                 )
+            UPDATE crm_lead AS l
+               SET last_wa_inbound = GREATEST(l.last_wa_inbound, v.stamp),
+                   reply_window_deadline = GREATEST(l.last_wa_inbound, v.stamp) + interval '1 hour' * %s,
+                   write_date = (now() at time zone 'UTC')
+              FROM v
+             WHERE l.id = v.id AND l.id IN (SELECT id FROM locked)
+        """.format(values=values), params + [REPLY_WINDOW_HOURS])
+        self.browse(list(stamps)).invalidate_cache(['last_wa_inbound', 'reply_window_deadline', 'write_date'])
+
+    @staticmethod
+    def _wa_message_datetime(message):
+        """UTC datetime of a webhook message from its unix ``timestamp``."""
+        try:
+            return datetime.utcfromtimestamp(int(message.get('timestamp')))
+        except (TypeError, ValueError):
+            return fields.Datetime.now()
+
+    @api.model
+    def _wa_touch_from_messages(self, messages):
+        """Bump last_wa_inbound on the leads of all senders in ``messages``,
+        keeping the newest message timestamp per lead."""
+        newest_by_sender = {}
+        for message in messages:
+            sender = message.get('from')
+            if not sender:
+                continue
+            stamp = self._wa_message_datetime(message)
+            if sender not in newest_by_sender or stamp > newest_by_sender[sender]:
+                newest_by_sender[sender] = stamp
+        if not newest_by_sender:
+            return {}
+
+        lead_by_sender = self._wa_match_leads(list(newest_by_sender))
+        stamps = {}
+        for sender, stamp in newest_by_sender.items():
+            lead_id = lead_by_sender.get(sender)
+            if not lead_id:
+                _logger.info("No lead matched for inbound WA from %s", sender)
+                continue
+            if lead_id not in stamps or stamp > stamps[lead_id]:
+                stamps[lead_id] = stamp
+        self._wa_register_inbound(stamps)
+        _logger.info("Updated last_wa_inbound on leads %s", list(stamps))
+        return lead_by_sender
+
+    # ---------- live refresh ----------
+    @api.model
+    def _wa_notify_leads(self, lead_ids, chatter=False):
+        """
+        Tell open lead forms that ``lead_ids`` changed: one bus notification
+        per lead, however many events touched it, sent on the lead's own
+        channel (forms showing it) and to its internal followers and salesperson.
+        """
+        lead_ids = list(set(lead_ids))
+        if not lead_ids:
+            return
+        cr = self.env.cr
+        cr.execute("""
+            SELECT f.res_id, f.partner_id
+              FROM mail_followers f
+              JOIN res_users u ON u.partner_id = f.partner_id AND u.active AND NOT u.share
+             WHERE f.res_model = 'crm.lead' AND f.res_id = ANY(%s)
+            UNION
+            SELECT l.id, u.partner_id
+              FROM crm_lead l
+              JOIN res_users u ON u.id = l.user_id
+             WHERE l.id = ANY(%s)
+        """, (lead_ids, lead_ids))
+        partners_by_lead = {}
+        for lead_id, partner_id in cr.fetchall():
+            partners_by_lead.setdefault(lead_id, set()).add(partner_id)
+
+        notifications = []
+        for lead_id in lead_ids:
+            message = {
+                'type': 'whatsapp_lead_update',
+                'uid': uuid.uuid4().hex,  # the same update may arrive on several channels
+                'lead_id': lead_id,
+                'fields': LIVE_FIELDS,
+                'chatter': chatter,
+            }
+            notifications.append(['whatsapp_lead_%s' % lead_id, message])
+            for partner_id in partners_by_lead.get(lead_id, ()):
+                notifications.append([(cr.dbname, 'res.partner', partner_id), message])
+        self.env['bus.bus'].sendmany(notifications)
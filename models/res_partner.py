@@ -3,7 +3,8 @@
 from odoo import models
 
 class ResPartner(models.Model):
-    _inherit = 'res.partner'
+    _name = 'res.partner'
+    _inherit = ['res.partner', 'whatsapp.phone.mixin']
 
     # The button now opens a wizard, so the Python function is no longer needed here.
     # You can add other partner-related WhatsApp logic here in the future.
\ No newline at end of file
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# whatsapp_meta_integration/models/sale_order.py
+import base64
+import time
+
+from odoo import fields, models
+from odoo.tools.safe_eval import safe_eval
+
+from ..tools import metrics
+
+# ir.attachment description marking the order PDFs rendered for WhatsApp, per revision
+REPORT_CACHE_PREFIX = 'whatsapp_report:'
+
+
+class SaleOrder(models.Model):
+    _inherit = 'sale.order'
+
+    def _wa_report_attachment(self):
+        """
+        The quotation/order PDF of this order's current revision (its
+        write_date), rendered once: resending an unchanged order reuses the
+        file, and through its checksum the media id already uploaded to Meta
+        (whatsapp.media). PDFs of older revisions are dropped unless a queued
+        message still needs them.
+        """
+        self.ensure_one()
+        Attachment = self.env['ir.attachment'].sudo()
+        revision = REPORT_CACHE_PREFIX + fields.Datetime.to_string(self.write_date)
+        domain = [('res_model', '=', self._name), ('res_id', '=', self.id)]
+        cached = Attachment.search(domain + [('description', '=', revision)], limit=1)
+        if cached:
+            metrics.inc('whatsapp_report_cache_total', outcome='hit')
+            return cached
+        metrics.inc('whatsapp_report_cache_total', outcome='miss')
+
+        report = self.env.ref('sale.action_report_saleorder').sudo()
+        with metrics.timer('whatsapp_report_render_seconds'):
+            pdf, _format = report.render_qweb_pdf(self.ids)
+        name = self.name
+        if report.print_report_name:
+            name = safe_eval(report.print_report_name, {'object': self, 'time': time})
+        attachment = Attachment.create({
+            'name': '%s.pdf' % name,
+            'res_model': self._name,
+            'res_id': self.id,
+            'type': 'binary',
+            'datas': base64.b64encode(pdf),
+            'mimetype': 'application/pdf',
+            'description': revision,
+        })
+
+        stale = Attachment.search(domain + [('description', '=like', REPORT_CACHE_PREFIX + '%'),
+                                            ('id', '!=', attachment.id)])
+        if stale:
+            in_use = self.env['whatsapp.outbox'].sudo().search([
+                ('state', '=', 'queued'), ('attachment_id', 'in', stale.ids)]).mapped('attachment_id')
+            (stale - in_use).unlink()
+        return attachment
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+# whatsapp_meta_integration/models/whatsapp_account.py
+import itertools
+import logging
+
+from odoo import api, fields, models, tools, _
+from odoo.exceptions import UserError
+
+from ..tools.graph_client import DEFAULT_API_VERSION, GraphClient
+
+_logger = logging.getLogger(__name__)
+
+# Per-process round-robin position over the accounts left after team/company routing
+_round_robin = itertools.count()
+
+# The account mirroring the credentials of the settings page
+DEFAULT_ACCOUNT_PARAM = 'whatsapp_meta.default_account_id'
+SETTINGS_PARAMS = {
+    'whatsapp_meta.access_token': 'access_token',
+    'whatsapp_meta.phone_number_id': 'phone_number_id',
+    'whatsapp_meta.waba_id': 'waba_id',
+    'whatsapp_meta.verify_token': 'verify_token',
+}
+
+
+class WhatsappAccount(models.Model):
+    """A WhatsApp Business phone number (and its WABA) messages can be sent from."""
+    _name = 'whatsapp.account'
+    _description = 'WhatsApp Account'
+    _order = 'sequence, id'
+
+    name = fields.Char(string='Name', required=True)
+    active = fields.Boolean(default=True)
+    sequence = fields.Integer(default=10, help="The first account is the default one.")
+    access_token = fields.Char(string='Meta Access Token', required=True, groups='base.group_system')
+    phone_number_id = fields.Char(string='Phone Number ID', required=True)
+    waba_id = fields.Char(string='WhatsApp Business Account ID (WABA ID)')
+    verify_token = fields.Char(string='Webhook Verify Token', groups='base.group_system')
+    api_version = fields.Char(string='Graph API Version', default=DEFAULT_API_VERSION, required=True)
+    company_id = fields.Many2one('res.company', string='Company', help="Route records of this company to this number.")
+    team_ids = fields.Many2many(
+        'crm.team', 'whatsapp_account_crm_team_rel', 'account_id', 'team_id', string='Sales Teams',
+        help="Route records of these sales teams to this number.")
+
+    _sql_constraints = [
+        ('phone_number_id_uniq', 'unique(phone_number_id)', 'This phone number ID is already configured.'),
+    ]
+
+    # ---------- cache invalidation ----------
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.clear_caches()
+        return records
+
+    def write(self, vals):
+        res = super().write(vals)
+        self.clear_caches()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.clear_caches()
+        return res
+
+    # ---------- cached credentials ----------
+    @api.model
+    @tools.ormcache('account_id')
+    def _get_credentials(self, account_id):
+        """(access token, phone number id, WABA id, API version), cached per process."""
+        account = self.sudo().browse(account_id)
+        return account.access_token, account.phone_number_id, account.waba_id, account.api_version
+
+    @api.model
+    @tools.ormcache()
+    def _routing_table(self):
+        """Active accounts as (id, company id, team ids), in sequence order."""
+        return tuple(
+            (account.id, account.company_id.id, tuple(account.team_ids.ids))
+            for account in self.sudo().search([])
+        )
+
+    def _client(self):
+        self.ensure_one()
+        access_token, phone_number_id, waba_id, api_version = self._get_credentials(self.id)
+        # Only set to point at a proxy or a local stand-in (see benchmarks/)
+        base_url = self.env['ir.config_parameter'].sudo().get_param('whatsapp_meta.graph_url')
+        return GraphClient(access_token, phone_number_id=phone_number_id, waba_id=waba_id, api_version=api_version,
+                           base_url=base_url)
+
+    @api.model
+    def _ensure_default_account(self):
+        """Create the first account from the settings parameters if none exists yet."""
+        if not self.sudo().with_context(active_test=False).search_count([]):
+            self._create_default_account()
+
+    @api.model
+    def _create_default_account(self):
+        """Create the default account from the settings parameters, if set."""
+        Account = self.sudo().with_context(active_test=False)
+        ICP = self.env['ir.config_parameter'].sudo()
+        # Settings write whatsapp_meta.*; older installs used whatsapp.*
+        access_token = ICP.get_param('whatsapp_meta.access_token') or ICP.get_param('whatsapp.access_token')
+        phone_number_id = ICP.get_param('whatsapp_meta.phone_number_id') or ICP.get_param('whatsapp.phone_number_id')
+        if not access_token or not phone_number_id:
+            return
+        account = Account.create({
+            'name': _('Default'),
+            'access_token': access_token,
+            'phone_number_id': phone_number_id,
+            'waba_id': ICP.get_param('whatsapp_meta.waba_id') or False,
+            'verify_token': ICP.get_param('whatsapp_meta.verify_token') or ICP.get_param('whatsapp.verify_token') or False,
+            'api_version': ICP.get_param('whatsapp.api_version') or DEFAULT_API_VERSION,
+        })
+        ICP.set_param(DEFAULT_ACCOUNT_PARAM, account.id)
+
+    @api.model
+    def _settings_values(self):
+        """The credentials of the settings page, as account field values."""
+        ICP = self.env['ir.config_parameter'].sudo()
+        return {field: ICP.get_param(param) or False for param, field in SETTINGS_PARAMS.items()}
+
+    @api.model
+    def _sync_default_account(self, previous):
+        """
+        Apply to the default account the settings credentials changed since
+        ``previous`` (_settings_values before the save). Saving the settings
+        without touching them leaves the account, and the edits made on its
+        form, alone.
+        """
+        current = self._settings_values()
+        changed = {field: value for field, value in current.items() if value != previous.get(field)}
+        # Clearing a required credential in the settings does not clear it on the account
+        changed = {field: value for field, value in changed.items()
+                   if value or field not in ('access_token', 'phone_number_id')}
+        if not changed:
+            return
+        ICP = self.env['ir.config_parameter'].sudo()
+        Account = self.sudo().with_context(active_test=False)
+        account = Account.browse(int(ICP.get_param(DEFAULT_ACCOUNT_PARAM) or 0)).exists()
+        if not account:
+            # Installs from before the default account was recorded: the one the settings mirrored
+            numbers = [number for number in (previous.get('phone_number_id'), current['phone_number_id']) if number]
+            account = Account.search([('phone_number_id', 'in', numbers)], limit=1)
+            if not account:
+                self._create_default_account()
+                return
+            ICP.set_param(DEFAULT_ACCOUNT_PARAM, account.id)
+        if 'phone_number_id' in changed and Account.search_count([
+                ('phone_number_id', '=', changed['phone_number_id']), ('id', '!=', account.id)]):
+            raise UserError(_("The phone number ID %s is already configured on another WhatsApp account.")
+                            % changed['phone_number_id'])
+        account.write(changed)
+
+    # ---------- routing ----------
+    @api.model
+    def _accounts_table(self):
+        """The routing table, first creating the default account from the
+        settings when there is none (the cached lookup itself never writes)."""
+        table = self._routing_table()
+        if not table:
+            self._ensure_default_account()
+            table = self._routing_table()
+        return table
+
+    @api.model
+    def _route(self, record=None):
+        """
+        Pick the account to send from for ``record``: an account of its sales
+        team, else of its company, else round-robin over the remaining ones.
+        """
+        table = self._accounts_table()
+        if not table:
+            raise UserError(_("No WhatsApp account is configured."))
+        team_id = record.team_id.id if record is not None and 'team_id' in record._fields else False
+        company_id = record.company_id.id if record is not None and 'company_id' in record._fields else False
+        if team_id:
+            matches = [account_id for account_id, _company, team_ids in table if team_id in team_ids]
+            if matches:
+                return self.browse(matches[0])
+        if company_id:
+            matches = [account_id for account_id, company, _teams in table if company == company_id]
+            if matches:
+                return self.browse(matches[next(_round_robin) % len(matches)])
+        pool = [account_id for account_id, company, team_ids in table if not team_ids and not company] \
+            or [account_id for account_id, _company, _teams in table]
+        return self.browse(pool[next(_round_robin) % len(pool)])
+
+    @api.model
+    def _by_phone_number_id(self, phone_number_id):
+        for account_id, _company, _teams in self._accounts_table():
+            if self._get_credentials(account_id)[1] == phone_number_id:
+                return self.browse(account_id)
+        return self.browse()
+
+    @api.model
+    def _default_account(self):
+        """The account mirroring the settings, else the first active one."""
+        table = self._accounts_table()
+        default_id = int(self.env['ir.config_parameter'].sudo().get_param(DEFAULT_ACCOUNT_PARAM) or 0)
+        if any(account_id == default_id for account_id, _company, _teams in table):
+            return self.browse(default_id)
+        return self.browse(table[0][0] if table else [])
+
+    @api.model
+    def _webhook_account(self, phone_number_id):
+        """The account a webhook event belongs to. Events for a number that is
+        not configured fall back to the default account, so both directions of
+        a chat share one conversation key (number, account)."""
+        return self._by_phone_number_id(phone_number_id) or self._default_account()
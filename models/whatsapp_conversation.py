@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+# whatsapp_meta_integration/models/whatsapp_conversation.py
+import logging
+from datetime import timedelta
+
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError
+
+from .crm_lead import REPLY_WINDOW_HOURS
+
+_logger = logging.getLogger(__name__)
+
+PREVIEW_LENGTH = 120
+
+
+def _conversation_number(number):
+    """Conversations are keyed on digits only: webhooks send 2010..., the outbox +2010..."""
+    return (number or '').lstrip('+') or False
+
+
+class WhatsappConversation(models.Model):
+    """
+    Agent inbox read-model: one row per customer number and account, kept
+    up to date by the message log with one upsert per batch. Everything the
+    inbox list shows is stored here, so it loads with a single query.
+    """
+    _name = 'whatsapp.conversation'
+    _description = 'WhatsApp Conversation'
+    _order = 'last_message_date desc, id desc'
+
+    name = fields.Char(string='Customer', readonly=True)
+    number = fields.Char(string='Customer Number', required=True, readonly=True)
+    account_id = fields.Many2one('whatsapp.account', string='Account', ondelete='cascade', readonly=True)
+    lead_id = fields.Many2one('crm.lead', string='Lead', index=True, ondelete='set null', readonly=True)
+    partner_id = fields.Many2one('res.partner', string='Contact', ondelete='set null', readonly=True)
+    user_id = fields.Many2one('res.users', string='Assigned To', index=True, ondelete='set null')
+    last_message_date = fields.Datetime(string='Last Message', index=True, readonly=True)
+    last_message_body = fields.Char(string='Last Message Text', readonly=True)
+    last_direction = fields.Selection([
+        ('in', 'Customer'),
+        ('out', 'Us'),
+    ], string='Last From', index=True, readonly=True)
+    unread_count = fields.Integer(string='Unread', readonly=True)
+    reply_window_deadline = fields.Datetime(string='WA reply deadline', index=True, readonly=True)
+    reply_window_open = fields.Boolean(
+        string='WA 24h Window Open',
+        compute='_compute_reply_window_open',
+        search='_search_reply_window_open',
+    )
+
+    def init(self):
+        # account_id may be empty (webhook from an unknown number): COALESCE so it still conflicts
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS whatsapp_conversation_number_account_uniq
+                ON whatsapp_conversation (number, COALESCE(account_id, 0))
+        """)
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS whatsapp_conversation_user_last_idx
+                ON whatsapp_conversation (user_id, last_message_date DESC)
+        """)
+
+    @api.depends('reply_window_deadline')
+    def _compute_reply_window_open(self):
+        now = fields.Datetime.now()
+        for conversation in self:
+            conversation.reply_window_open = bool(
+                conversation.reply_window_deadline and conversation.reply_window_deadline > now)
+
+    def _search_reply_window_open(self, operator, value):
+        if operator not in ('=', '!='):
+            raise UserError(_("Operation not supported."))
+        now = fields.Datetime.now()
+        if (operator == '=') == bool(value):
+            return [('reply_window_deadline', '>', now)]
+        return ['|', ('reply_window_deadline', '=', False), ('reply_window_deadline', '<=', now)]
+
+    # ---------- incremental maintenance ----------
+    @api.model
+    def _touch(self, events):
+        """
+        Fold message events into their conversations with one upsert.
+        ``events`` are dicts with number, account_id, lead_id, partner_id,
+        direction, date and body. Events are merged per conversation first;
+        the latest message wins, inbound ones add to the unread count and
+        extend the reply window, and a newer outbound one marks it read.
+        The conversation follows its lead's current salesperson.
+        Both crons upsert these rows, so a concurrent update may fail with a
+        serialization error: callers retry it in a new transaction without
+        touching their own state (whatsapp.outbox._log_results after the
+        outbox commit, the inbox cron by leaving its batch pending).
+        """
+        merged = {}
+        for event in events:
+            number = _conversation_number(event.get('number'))
+            if not number or not event.get('date'):
+                continue
+            key = (number, event.get('account_id') or None)
+            row = merged.get(key)
+            inbound = event['direction'] == 'in'
+            if row is None:
+                row = merged[key] = {'number': number, 'account_id': key[1], 'inbound': [], 'last_out': None,
+                                     'deadline': None, 'lead_id': None, 'partner_id': None, 'date': None}
+            if inbound:
+                row['inbound'].append(event['date'])
+                deadline = event['date'] + timedelta(hours=REPLY_WINDOW_HOURS)
+                row['deadline'] = max(row['deadline'], deadline) if row['deadline'] else deadline
+            elif row['last_out'] is None or event['date'] > row['last_out']:
+                row['last_out'] = event['date']
+            row['lead_id'] = event.get('lead_id') or row['lead_id']
+            row['partner_id'] = event.get('partner_id') or row['partner_id']
+            if row['date'] is None or event['date'] >= row['date']:
+                row.update(date=event['date'], direction=event['direction'],
+                           body=(event.get('body') or '')[:PREVIEW_LENGTH] or None)
+        if not merged:
+            return
+
+        leads = self.env['crm.lead'].sudo().browse({row['lead_id'] for row in merged.values() if row['lead_id']})
+        partners = self.env['res.partner'].sudo().browse({row['partner_id'] for row in merged.values() if row['partner_id']})
+        lead_info = {lead.id: (lead.partner_id.name or lead.name, lead.user_id.id) for lead in leads}
+        partner_name = {partner.id: partner.name for partner in partners}
+        values = []
+        for row in merged.values():
+            name, user_id = lead_info.get(row['lead_id'], (None, None))
+            name = partner_name.get(row['partner_id']) or name or row['number']
+            # Only messages after our last reply of the batch are unread
+            unread = len([date for date in row['inbound'] if row['last_out'] is None or date > row['last_out']])
+            values.append((row['number'], row['account_id'], row['lead_id'], row['partner_id'], user_id or None,
+                           name, row['date'], row['body'], row['direction'], unread, row['deadline']))
+
+        placeholders = "(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, now() at time zone 'UTC', now() at time zone 'UTC')"
+        self.env.cr.execute("""
+            INSERT INTO whatsapp_conversation AS c
+                   (number, account_id, lead_id, partner_id, user_id, name, last_message_date,
+                    last_message_body, last_direction, unread_count, reply_window_deadline, create_date, write_date)
+            VALUES {values}
+            ON CONFLICT (number, COALESCE(account_id, 0)) DO UPDATE SET
+                   lead_id = COALESCE(EXCLUDED.lead_id, c.lead_id),
+                   partner_id = COALESCE(EXCLUDED.partner_id, c.partner_id),
+                   user_id = COALESCE(EXCLUDED.user_id, c.user_id),
+                   name = COALESCE(EXCLUDED.name, c.name),
+                   last_message_body = CASE WHEN EXCLUDED.last_message_date >= c.last_message_date
+                                            THEN EXCLUDED.last_message_body ELSE c.last_message_body END,
+                   last_direction = CASE WHEN EXCLUDED.last_message_date >= c.last_message_date
+                                         THEN EXCLUDED.last_direction ELSE c.last_direction END,
+                   last_message_date = GREATEST(c.last_message_date, EXCLUDED.last_message_date),
+                   unread_count = CASE WHEN EXCLUDED.last_direction = 'out'
+                                        AND EXCLUDED.last_message_date >= c.last_message_date
+                                       THEN 0 ELSE c.unread_count + EXCLUDED.unread_count END,
+                   reply_window_deadline = GREATEST(c.reply_window_deadline, EXCLUDED.reply_window_deadline),
+                   write_date = EXCLUDED.write_date
+        """.format(values=", ".join([placeholders] * len(values))), [item for row in values for item in row])
+        self.invalidate_cache()
+
+    # ---------- actions ----------
+    def action_mark_read(self):
+        self.sudo().write({'unread_count': 0})
+
+    def action_open_lead(self):
+        self.ensure_one()
+        if not self.lead_id:
+            raise UserError(_("No lead is linked to this conversation yet."))
+        self.action_mark_read()
+        return {
+            'type': 'ir.actions.act_window',
+            'res_model': 'crm.lead',
+            'res_id': self.lead_id.id,
+            'view_mode': 'form',
+            'views': [(False, 'form')],
+        }
+
+    def action_reply(self):
+        self.ensure_one()
+        if not self.lead_id:
+            raise UserError(_("No lead is linked to this conversation yet."))
+        self.action_mark_read()
+        return self.lead_id.action_open_whatsapp_reply_wizard()
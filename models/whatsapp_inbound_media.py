@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+# whatsapp_meta_integration/models/whatsapp_inbound_media.py
+import base64
+import binascii
+import logging
+import mimetypes
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from odoo import api, fields, models, _
+from odoo.tools import html_escape
+
+from ..tools import metrics
+from ..tools.graph_client import WhatsAppApiError
+from .whatsapp_outbox import BACKOFF_SECONDS, MAX_ATTEMPTS, MAX_MEDIA_BYTES
+
+_logger = logging.getLogger(__name__)
+
+MEDIA_TYPES = ('image', 'document', 'audio', 'video', 'sticker')
+HEX_SHA256_RE = re.compile(r'^[0-9a-fA-F]{64}$')
+
+
+def _hex_sha256(value):
+    """A file digest as hex, the form downloads are hashed in. Webhooks
+    send it base64-encoded; anything that is not a SHA-256 gives None."""
+    if not value:
+        return None
+    if HEX_SHA256_RE.match(value):
+        return value.lower()
+    try:
+        digest = base64.b64decode(value, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    return digest.hex() if len(digest) == 32 else None
+
+
+class WhatsappInboundMedia(models.Model):
+    """
+    Files customers sent, waiting to be downloaded onto their lead.
+    The inbox cron only queues them here; a separate cron streams each file
+    into the filestore. Files are deduplicated by sha256: a file already
+    received (e.g. a forwarded flyer) is linked again, never downloaded or
+    stored twice.
+    """
+    _name = 'whatsapp.inbound.media'
+    _description = 'WhatsApp Inbound Media'
+    _order = 'id desc'
+
+    media_id = fields.Char(string='Media ID', required=True, readonly=True)
+    wamid = fields.Char(string='WhatsApp Message ID', readonly=True)
+    lead_id = fields.Many2one('crm.lead', string='Lead', required=True, ondelete='cascade', readonly=True)
+    account_id = fields.Many2one('whatsapp.account', string='Account', ondelete='cascade', readonly=True)
+    media_type = fields.Char(string='Type', readonly=True)
+    mimetype = fields.Char(string='MIME Type', readonly=True)
+    filename = fields.Char(string='File Name', readonly=True)
+    caption = fields.Text(string='Caption', readonly=True)
+    sha256 = fields.Char(string='SHA-256', index=True, readonly=True)
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('done', 'Downloaded'),
+        ('error', 'Error'),
+    ], string='Status', default='pending', required=True, index=True, readonly=True)
+    attempts = fields.Integer(string='Attempts', default=0, readonly=True)
+    next_attempt = fields.Datetime(string='Next Attempt', default=fields.Datetime.now, readonly=True)
+    attachment_id = fields.Many2one('ir.attachment', string='Attachment', ondelete='set null', readonly=True)
+    error = fields.Text(string='Error', readonly=True)
+
+    _sql_constraints = [
+        ('media_id_uniq', 'unique(media_id)', 'This media was already queued.'),
+    ]
+
+    # ---------- intake (inbox cron) ----------
+    @api.model
+    def _enqueue_messages(self, items, lead_by_sender):
+        """Queue the media of webhook messages, given as (phone number id, message)
+        pairs, for the senders that matched a lead. Replays are ignored."""
+        Account = self.env['whatsapp.account']
+        rows = []
+        for phone_number_id, message in items:
+            media_type = message.get('type')
+            content = message.get(media_type) if media_type in MEDIA_TYPES else None
+            lead_id = lead_by_sender.get(message.get('from'))
+            if not content or not content.get('id') or not lead_id:
+                continue
+            rows.append((content['id'], message.get('id'), lead_id,
+                         Account._webhook_account(phone_number_id).id or None, media_type,
+                         content.get('mime_type'), content.get('filename'), content.get('caption'),
+                         _hex_sha256(content.get('sha256'))))
+        if not rows:
+            return 0
+        values = ", ".join(["(%s, %s, %s, %s, %s, %s, %s, %s, %s, 'pending', 0, "
+                            "now() at time zone 'UTC', now() at time zone 'UTC', now() at time zone 'UTC')"] * len(rows))
+        self.env.cr.execute("""
+            INSERT INTO whatsapp_inbound_media
+                   (media_id, wamid, lead_id, account_id, media_type, mimetype, filename, caption, sha256,
+                    state, attempts, next_attempt, create_date, write_date)
+            VALUES {values}
+            ON CONFLICT (media_id) DO NOTHING
+        """.format(values=values), [item for row in rows for item in row])
+        return self.env.cr.rowcount
+
+    def action_retry(self):
+        self.filtered(lambda m: m.state == 'error').write({
+            'state': 'pending', 'attempts': 0, 'next_attempt': fields.Datetime.now(), 'error': False,
+        })
+
+    # ---------- storage ----------
+    def _attachment_name(self):
+        self.ensure_one()
+        if self.filename:
+            return self.filename
+        extension = mimetypes.guess_extension(self.mimetype or '') or ''
+        return '%s-%s%s' % (self.media_type or 'file', self.id, extension)
+
+    def _known_attachment(self, sha256):
+        """An attachment already holding the file with this sha256, preferably on the same lead."""
+        self.ensure_one()
+        if not sha256:
+            return self.env['ir.attachment']
+        done = self.search([('sha256', '=', sha256), ('state', '=', 'done'), ('attachment_id', '!=', False)])
+        same_lead = done.filtered(lambda m: m.lead_id == self.lead_id)
+        return (same_lead or done)[:1].attachment_id
+
+    def _link_attachment(self, source):
+        """Attach the file of ``source`` to this lead, sharing its stored file."""
+        self.ensure_one()
+        if source.res_model == 'crm.lead' and source.res_id == self.lead_id.id:
+            return source
+        if not source.store_fname:
+            return source.sudo().copy({'name': self._attachment_name(), 'res_model': 'crm.lead',
+                                       'res_id': self.lead_id.id})
+        return self._create_file_attachment(source.store_fname, source.checksum, source.file_size,
+                                            source.mimetype)
+
+    def _create_file_attachment(self, store_fname, checksum, file_size, mimetype):
+        attachment = self.env['ir.attachment'].sudo().create({
+            'name': self._attachment_name(),
+            'res_model': 'crm.lead',
+            'res_id': self.lead_id.id,
+            'type': 'binary',
+            'mimetype': mimetype or self.mimetype,
+            'store_fname': store_fname,
+        })
+        # create() drops checksum/file_size, which it only derives from in-memory data
+        self.env.cr.execute("UPDATE ir_attachment SET checksum = %s, file_size = %s WHERE id = %s",
+                            (checksum, file_size, attachment.id))
+        attachment.invalidate_cache(['checksum', 'file_size'])
+        return attachment
+
+    def _store_download(self, path, info):
+        """Move a downloaded temporary file into the filestore (or the database)."""
+        self.ensure_one()
+        Attachment = self.env['ir.attachment'].sudo()
+        if Attachment._storage() != 'file':
+            with open(path, 'rb') as fileobj:
+                datas = base64.b64encode(fileobj.read())
+            os.unlink(path)
+            return Attachment.create({'name': self._attachment_name(), 'res_model': 'crm.lead',
+                                      'res_id': self.lead_id.id, 'datas': datas,
+                                      'mimetype': info['mimetype'] or self.mimetype})
+        fname, full_path = Attachment._get_path(None, info['sha1'])
+        if os.path.exists(full_path):
+            os.unlink(path)  # the filestore is content-addressed: same bytes, same file
+        else:
+            os.replace(path, full_path)
+            Attachment._mark_for_gc(fname)
+        return self._create_file_attachment(fname, info['sha1'], info['size'], info['mimetype'])
+
+    def _finish(self, attachment):
+        self.write({'state': 'done', 'attachment_id': attachment.id, 'error': False})
+        body = _("📎 WhatsApp %s received") % (self.media_type or _('file'))
+        if self.caption:
+            body += ": %s" % html_escape(self.caption)
+        self.lead_id.message_post(body=body, attachment_ids=[attachment.id],
+                                  message_type='comment', subtype_xmlid='mail.mt_note')
+
+    def _fail(self, error):
+        attempts = self.attempts + 1
+        if getattr(error, 'retryable', False) and attempts < MAX_ATTEMPTS:
+            self.write({'attempts': attempts, 'error': str(error),
+                        'next_attempt': fields.Datetime.now() + timedelta(seconds=BACKOFF_SECONDS * (2 ** (attempts - 1)))})
+        else:
+            self.write({'state': 'error', 'attempts': attempts, 'error': str(error)})
+        _logger.warning("WhatsApp media %s download failed (attempt %s): %s", self.media_id, attempts, error)
+
+    # ---------- download (worker threads) ----------
+    @staticmethod
+    def _download(client, media_id, directory):
+        """Stream one file to a temporary file. Runs in a worker thread: no ORM access here.
+        Returns (temporary path, info, error)."""
+        fd, path = tempfile.mkstemp(prefix='wa-media-', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as fileobj:
+                info = client.download_media(media_id, fileobj, max_bytes=MAX_MEDIA_BYTES)
+            return path, info, None
+        except Exception as e:
+            os.unlink(path)
+            if not isinstance(e, WhatsAppApiError):
+                _logger.exception("Unexpected error downloading WhatsApp media %s", media_id)
+                e = WhatsAppApiError(str(e))
+            return None, None, e
+
+    # ---------- cron ----------
+    @api.model
+    def _cron_download(self, batch_size=50, time_budget=240):
+        """
+        Download due media in batches. Files whose sha256 (sent by the webhook)
+        is already known are linked without any download; the others are
+        streamed concurrently to temporary files next to the filestore, then
+        moved in place (or dropped if the same bytes are already stored).
+        """
+        auto_commit = not getattr(threading.currentThread(), 'testing', False)
+        concurrency = int(self.env['ir.config_parameter'].sudo().get_param('whatsapp_meta.download_concurrency', 4))
+        Attachment = self.env['ir.attachment'].sudo()
+        # Same filesystem as the filestore, so finished files are renamed, not copied
+        directory = Attachment._full_path('tmp')
+        os.makedirs(directory, exist_ok=True)
+        clients = {}
+        started = time.time()
+
+        with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+            while time.time() - started < time_budget:
+                self.env.cr.execute("""
+                    SELECT id FROM whatsapp_inbound_media
+                     WHERE state = 'pending' AND next_attempt <= (now() at time zone 'UTC')
+                     ORDER BY id
+                     LIMIT %s
+                       FOR UPDATE SKIP LOCKED
+                """, (batch_size,))
+                ids = [row[0] for row in self.env.cr.fetchall()]
+                if not ids:
+                    break
+
+                futures = []
+                lead_ids = []
+                for media in self.browse(ids):
+                    known = media._known_attachment(media.sha256)
+                    if known:
+                        media._finish(media._link_attachment(known))
+                        lead_ids.append(media.lead_id.id)
+                        continue
+                    account = media.account_id or self.env['whatsapp.account']._route(media.lead_id)
+                    if account.id not in clients:
+                        clients[account.id] = account._client()
+                    futures.append((media, executor.submit(self._download, clients[account.id],
+                                                           media.media_id, directory)))
+
+                for media, future in futures:
+                    path, info, error = future.result()
+                    if error:
+                        media._fail(error)
+                        continue
+                    if media.sha256 and media.sha256 != info['sha256']:
+                        _logger.warning("WhatsApp media %s: sha256 differs from the webhook's", media.media_id)
+                    media.sha256 = info['sha256']
+                    # Another message of this batch may have brought the same file
+                    known = media._known_attachment(info['sha256'])
+                    if known:
+                        os.unlink(path)
+                        attachment = media._link_attachment(known)
+                    else:
+                        attachment = media._store_download(path, info)
+                    media._finish(attachment)
+                    lead_ids.append(media.lead_id.id)
+
+                self.env['crm.lead']._wa_notify_leads(lead_ids, chatter=True)
+                if auto_commit:
+                    self.env.cr.commit()
+        metrics.observe('whatsapp_cron_seconds', time.time() - started, job='inbound_media')
+        self.env['whatsapp.metrics.snapshot']._flush()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# whatsapp_meta_integration/models/whatsapp_media.py
+import logging
+from datetime import timedelta
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+# Meta keeps uploaded media for 30 days; stop reusing ids a day earlier.
+MEDIA_TTL_DAYS = 29
+
+
+class WhatsappMedia(models.Model):
+    """Media ids already uploaded to Meta, keyed by attachment checksum and
+    phone number, so sending the same file again skips the upload."""
+    _name = 'whatsapp.media'
+    _description = 'WhatsApp Uploaded Media'
+    _order = 'id desc'
+
+    checksum = fields.Char(string='Checksum', required=True, index=True, readonly=True)
+    phone_number_id = fields.Char(string='Phone Number ID', required=True, readonly=True)
+    media_id = fields.Char(string='Media ID', required=True, readonly=True)
+    expires_at = fields.Datetime(string='Expires On', required=True, index=True, readonly=True)
+
+    _sql_constraints = [
+        ('checksum_phone_uniq', 'unique(checksum, phone_number_id)', 'Media already cached for this phone number.'),
+    ]
+
+    @api.model
+    def _get_media_id(self, checksum, phone_number_id):
+        """Return a still-valid media id for this content, or None."""
+        if not checksum:
+            return None
+        self.env.cr.execute("""
+            SELECT media_id FROM whatsapp_media
+             WHERE checksum = %s AND phone_number_id = %s
+               AND expires_at > (now() at time zone 'UTC')
+        """, (checksum, phone_number_id))
+        row = self.env.cr.fetchone()
+        return row[0] if row else None
+
+    @api.model
+    def _store(self, checksum, phone_number_id, media_id):
+        """Remember (or refresh) the media id uploaded for this content."""
+        if not checksum or not media_id:
+            return
+        self.env.cr.execute("""
+            INSERT INTO whatsapp_media (checksum, phone_number_id, media_id, expires_at,
+                                        create_date, write_date)
+            VALUES (%s, %s, %s, %s, now() at time zone 'UTC', now() at time zone 'UTC')
+            ON CONFLICT (checksum, phone_number_id)
+            DO UPDATE SET media_id = EXCLUDED.media_id,
+                          expires_at = EXCLUDED.expires_at,
+                          write_date = EXCLUDED.write_date
+        """, (checksum, phone_number_id, media_id, fields.Datetime.now() + timedelta(days=MEDIA_TTL_DAYS)))
+
+    @api.model
+    def _evict(self, checksum, phone_number_id):
+        self.env.cr.execute(
+            "DELETE FROM whatsapp_media WHERE checksum = %s AND phone_number_id = %s",
+            (checksum, phone_number_id))
+
+    @api.model
+    def _gc_expired(self):
+        self.env.cr.execute("DELETE FROM whatsapp_media WHERE expires_at <= (now() at time zone 'UTC')")
+        _logger.info("Removed %s expired WhatsApp media ids", self.env.cr.rowcount)
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+# whatsapp_meta_integration/models/whatsapp_message.py
+import logging
+import threading
+from datetime import timedelta
+
+from odoo import api, fields, models, tools
+
+_logger = logging.getLogger(__name__)
+
+ARCHIVE_TABLE = 'whatsapp_message_archive'
+ARCHIVE_CHUNK = 5000
+
+# Delivery states only move forward; a late 'sent' never overwrites 'read'
+STATE_RANK = {'received': 0, 'sent': 1, 'delivered': 2, 'read': 3, 'failed': 4}
+STATUS_DATE_FIELD = {'sent': 'sent_date', 'delivered': 'delivered_date', 'read': 'read_date', 'failed': 'failed_date'}
+
+
+def _rank_sql(column):
+    whens = " ".join("WHEN '%s' THEN %d" % item for item in STATE_RANK.items())
+    return "(CASE %s %s ELSE -1 END)" % (column, whens)
+
+
+class WhatsappMessage(models.Model):
+    """
+    One row per WhatsApp message sent or received, with its delivery state.
+    Written in bulk by the outbox and webhook crons; rows older than the
+    retention are moved to a plain SQL archive table.
+    """
+    _name = 'whatsapp.message'
+    _description = 'WhatsApp Message'
+    _order = 'id desc'
+    _rec_name = 'wamid'
+
+    wamid = fields.Char(string='WhatsApp Message ID', readonly=True)
+    direction = fields.Selection([
+        ('in', 'Inbound'),
+        ('out', 'Outbound'),
+    ], string='Direction', required=True, index=True, readonly=True)
+    account_id = fields.Many2one('whatsapp.account', string='Account', ondelete='set null', readonly=True)
+    number = fields.Char(string='Customer Number', index=True, readonly=True)
+    lead_id = fields.Many2one('crm.lead', string='Lead', index=True, ondelete='set null', readonly=True)
+    partner_id = fields.Many2one('res.partner', string='Contact', index=True, ondelete='set null', readonly=True)
+    template_id = fields.Many2one('whatsapp.template', string='Template', ondelete='set null', readonly=True)
+    message_type = fields.Char(string='Type', readonly=True)
+    body = fields.Text(string='Body', readonly=True)
+    state = fields.Selection([
+        ('received', 'Received'),
+        ('sent', 'Sent'),
+        ('delivered', 'Delivered'),
+        ('read', 'Read'),
+        ('failed', 'Failed'),
+    ], string='Status', required=True, index=True, readonly=True)
+    received_date = fields.Datetime(string='Received On', readonly=True)
+    sent_date = fields.Datetime(string='Sent On', readonly=True)
+    delivered_date = fields.Datetime(string='Delivered On', readonly=True)
+    read_date = fields.Datetime(string='Read On', readonly=True)
+    failed_date = fields.Datetime(string='Failed On', readonly=True)
+    error = fields.Text(string='Error', readonly=True)
+
+    _sql_constraints = [
+        ('wamid_uniq', 'unique(wamid)', 'This WhatsApp message is already logged.'),
+    ]
+
+    def init(self):
+        cr = self.env.cr
+        tools.create_index(cr, 'whatsapp_message_report_idx', self._table, ['direction', 'create_date', 'state'])
+        # Conversations touched since the last whatsapp.response.report refresh
+        tools.create_index(cr, 'whatsapp_message_write_date_idx', self._table, ['write_date'])
+        # Same columns, no constraints: only ever filled by _cron_archive
+        cr.execute("CREATE TABLE IF NOT EXISTS {archive} (LIKE {table})".format(archive=ARCHIVE_TABLE, table=self._table))
+        tools.create_index(cr, '%s_create_date_idx' % ARCHIVE_TABLE, ARCHIVE_TABLE, ['create_date'])
+        tools.create_index(cr, '%s_wamid_idx' % ARCHIVE_TABLE, ARCHIVE_TABLE, ['wamid'])
+        tools.create_index(cr, '%s_number_idx' % ARCHIVE_TABLE, ARCHIVE_TABLE, ['number'])
+
+    # ---------- bulk writes ----------
+    @api.model
+    def _upsert(self, columns, rows, on_conflict):
+        """Insert ``rows`` (tuples matching ``columns``) with one statement.
+        Returns the wamids inserted or updated (not those skipped)."""
+        if not rows:
+            return set()
+        placeholders = "(%s, now() at time zone 'UTC', now() at time zone 'UTC')" % ", ".join(["%s"] * len(columns))
+        self.env.cr.execute("""
+            INSERT INTO whatsapp_message AS m ({columns}, create_date, write_date)
+            VALUES {values}
+            ON CONFLICT (wamid) {on_conflict}
+            RETURNING wamid
+        """.format(columns=", ".join(columns), values=", ".join([placeholders] * len(rows)), on_conflict=on_conflict),
+            [item for row in rows for item in row])
+        written = {row[0] for row in self.env.cr.fetchall()}
+        self.invalidate_cache()
+        return written
+
+    @api.model
+    def _log_outbound(self, vals_list):
+        """Log sent (or definitively failed) messages. A status webhook may have
+        created the row first: its state and dates are kept."""
+        columns = ['wamid', 'direction', 'account_id', 'number', 'lead_id', 'partner_id', 'template_id',
+                   'message_type', 'body', 'state', 'sent_date', 'failed_date', 'error']
+        rows = [tuple(vals.get(column) or None for column in columns) for vals in vals_list]
+        self._upsert(columns, rows, """
+            DO UPDATE SET account_id = EXCLUDED.account_id,
+                          lead_id = EXCLUDED.lead_id,
+                          partner_id = EXCLUDED.partner_id,
+                          template_id = EXCLUDED.template_id,
+                          message_type = EXCLUDED.message_type,
+                          body = EXCLUDED.body,
+                          sent_date = COALESCE(m.sent_date, EXCLUDED.sent_date),
+                          write_date = EXCLUDED.write_date
+        """)
+        self.env['whatsapp.conversation']._touch([
+            dict(vals, direction='out', date=vals['sent_date'])
+            for vals in vals_list if vals.get('state') == 'sent'
+        ])
+
+    @api.model
+    def _log_inbound(self, items, lead_by_sender):
+        """Log webhook messages, given as (phone number id, message) pairs.
+        Replayed events are ignored by the unique wamid."""
+        Account = self.env['whatsapp.account']
+        leads = self.env['crm.lead'].browse(set(lead_by_sender.values()))
+        partner_by_lead = {lead.id: lead.partner_id.id for lead in leads}
+        columns = ['wamid', 'direction', 'account_id', 'number', 'lead_id', 'partner_id',
+                   'message_type', 'body', 'state', 'received_date']
+        rows = {}
+        for phone_number_id, message in items:
+            if not message.get('id'):
+                continue
+            lead_id = lead_by_sender.get(message.get('from'))
+            message_type = message.get('type')
+            content = message.get(message_type)
+            body = None
+            if isinstance(content, dict):
+                body = content.get('body') or content.get('caption') or content.get('filename')
+            rows[message['id']] = (
+                message['id'], 'in', Account._webhook_account(phone_number_id).id or None, message.get('from'),
+                lead_id, partner_by_lead.get(lead_id) or None, message_type, body, 'received',
+                self.env['crm.lead']._wa_message_datetime(message),
+            )
+        inserted = self._upsert(columns, list(rows.values()), "DO NOTHING")
+        # Replayed events were skipped above and must not count as unread again
+        self.env['whatsapp.conversation']._touch([
+            dict(zip(columns, row), date=row[-1]) for wamid, row in rows.items() if wamid in inserted
+        ])
+
+    @api.model
+    def _apply_statuses(self, items):
+        """
+        Apply status webhooks, given as (phone number id, status) pairs, with
+        one upsert keyed on wamid. Updates are merged per message first, and
+        the state only moves forward. Statuses arriving before the send was
+        logged create the row; the outbound log fills in the rest.
+        """
+        Account = self.env['whatsapp.account']
+        merged = {}
+        for phone_number_id, status in items:
+            wamid, state = status.get('id'), status.get('status')
+            if not wamid or state not in STATUS_DATE_FIELD:
+                continue
+            row = merged.setdefault(wamid, {
+                'wamid': wamid, 'direction': 'out', 'state': state, 'number': status.get('recipient_id'),
+                'account_id': Account._webhook_account(phone_number_id).id or None,
+            })
+            if STATE_RANK[state] > STATE_RANK[row['state']]:
+                row['state'] = state
+            date_field = STATUS_DATE_FIELD[state]
+            stamp = self.env['crm.lead']._wa_message_datetime(status)
+            row[date_field] = min(row[date_field], stamp) if row.get(date_field) else stamp
+            if state == 'failed':
+                row['error'] = '; '.join(
+                    '%s: %s' % (error.get('code'), error.get('title') or error.get('message'))
+                    for error in status.get('errors') or []) or None
+
+        columns = ['wamid', 'direction', 'account_id', 'number', 'state',
+                   'sent_date', 'delivered_date', 'read_date', 'failed_date', 'error']
+        rows = [tuple(row.get(column) for column in columns) for row in merged.values()]
+        self._upsert(columns, rows, """
+            DO UPDATE SET state = CASE WHEN {new_rank} > {old_rank} THEN EXCLUDED.state ELSE m.state END,
+                          sent_date = COALESCE(m.sent_date, EXCLUDED.sent_date),
+                          delivered_date = COALESCE(m.delivered_date, EXCLUDED.delivered_date),
+                          read_date = COALESCE(m.read_date, EXCLUDED.read_date),
+                          failed_date = COALESCE(m.failed_date, EXCLUDED.failed_date),
+                          error = COALESCE(EXCLUDED.error, m.error),
+                          write_date = EXCLUDED.write_date
+        """.format(new_rank=_rank_sql('EXCLUDED.state'), old_rank=_rank_sql('m.state')))
+
+    # ---------- retention ----------
+    @api.model
+    def _cron_archive(self):
+        """Move messages older than the retention (days) to the archive table, in chunks."""
+        auto_commit = not getattr(threading.currentThread(), 'testing', False)
+        days = int(self.env['ir.config_parameter'].sudo().get_param('whatsapp_meta.message_retention_days', 180))
+        limit = fields.Datetime.now() - timedelta(days=days)
+        cr = self.env.cr
+        # Columns added after the archive table was created are not archived
+        cr.execute("""
+            SELECT column_name FROM information_schema.columns WHERE table_name = %s
+            INTERSECT
+            SELECT column_name FROM information_schema.columns WHERE table_name = %s
+        """, (self._table, ARCHIVE_TABLE))
+        columns = ", ".join('"%s"' % row[0] for row in cr.fetchall())
+        while True:
+            cr.execute("""
+                WITH moved AS (
+                    DELETE FROM whatsapp_message
+                     WHERE id IN (SELECT id FROM whatsapp_message WHERE create_date < %s ORDER BY id LIMIT %s)
+                 RETURNING {columns}
+                )
+                INSERT INTO {archive} ({columns}) SELECT {columns} FROM moved
+            """.format(columns=columns, archive=ARCHIVE_TABLE), (limit, ARCHIVE_CHUNK))
+            moved = cr.rowcount
+            if auto_commit:
+                cr.commit()
+            if moved < ARCHIVE_CHUNK:
+                break
+        self.invalidate_cache()
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# whatsapp_meta_integration/models/whatsapp_metrics.py
+import json
+import logging
+import time
+from datetime import timedelta
+
+from odoo import api, fields, models
+
+from ..tools import metrics
+
+_logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = 15  # seconds between two stores of this process' totals
+SNAPSHOT_MAX_AGE_DAYS = 1
+
+_last_flush = [0.0]
+
+
+class WhatsappMetricsSnapshot(models.Model):
+    """Latest metric totals of each Odoo process (HTTP workers, cron worker),
+    so the metrics endpoint, served by any worker, reports all of them."""
+    _name = 'whatsapp.metrics.snapshot'
+    _description = 'WhatsApp Metrics Snapshot'
+    _log_access = False
+
+    key = fields.Char(string='Process', required=True, readonly=True)
+    payload = fields.Text(string='Totals', readonly=True)
+    updated_at = fields.Datetime(string='Updated', readonly=True)
+
+    _sql_constraints = [
+        ('key_uniq', 'unique(key)', 'One snapshot per process.'),
+    ]
+
+    @api.model
+    def _flush(self, force=False):
+        """Store this process' totals, at most every FLUSH_INTERVAL seconds."""
+        now = time.time()
+        if not force and now - _last_flush[0] < FLUSH_INTERVAL:
+            return
+        _last_flush[0] = now
+        self.env.cr.execute("""
+            INSERT INTO whatsapp_metrics_snapshot (key, payload, updated_at)
+            VALUES (%s, %s, now() at time zone 'UTC')
+            ON CONFLICT (key) DO UPDATE SET payload = EXCLUDED.payload, updated_at = EXCLUDED.updated_at
+        """, (metrics.process_key(), json.dumps(metrics.snapshot())))
+
+    @api.model
+    def _render(self):
+        """Prometheus text for every live process: this one's current totals
+        plus the last stored totals of the others."""
+        limit = fields.Datetime.now() - timedelta(days=SNAPSHOT_MAX_AGE_DAYS)
+        self.env.cr.execute("DELETE FROM whatsapp_metrics_snapshot WHERE updated_at < %s", (limit,))
+        self.env.cr.execute("SELECT payload FROM whatsapp_metrics_snapshot WHERE key != %s",
+                            (metrics.process_key(),))
+        snapshots = [json.loads(row[0]) for row in self.env.cr.fetchall() if row[0]]
+        snapshots.append(metrics.snapshot())
+        return metrics.render(snapshots)
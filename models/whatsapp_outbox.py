@@ -0,0 +1,426 @@
+# -*- coding: utf-8 -*-
+# whatsapp_meta_integration/models/whatsapp_outbox.py
+import base64
+import hashlib
+import json
+import logging
+import mimetypes
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import psycopg2
+
+from odoo import api, fields, models, _
+from odoo.tools import mute_logger
+
+from ..tools import metrics
+from ..tools.graph_client import WhatsAppApiError
+
+_logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 6
+BACKOFF_SECONDS = 60  # doubled after every failed attempt
+MAX_MEDIA_BYTES = 100 * 1024 * 1024
+DEDUPE_WINDOW_SECONDS = 60
+# Meta errors meaning the media id itself was refused: parameter value not
+# valid, media download error, media upload error. The generic "invalid
+# parameter" (100) is left out: most payload errors carry it.
+MEDIA_ERROR_CODES = (131009, 131052, 131053)
+LOG_ATTEMPTS = 3  # message log writes racing the inbox cron, see _log_results
+# First key of the per-message advisory locks taken while deduplicating sends
+OUTBOX_LOCK_NAMESPACE = 0x5742
+
+
+def _media_block(payload):
+    """The part of a /messages payload that takes the uploaded media id:
+    the media object itself, or the media header parameter of a template."""
+    wa_type = payload['type']
+    if wa_type != 'template':
+        return payload[wa_type]
+    header = next(c for c in payload['template']['components'] if c['type'] == 'header')
+    param = header['parameters'][0]
+    return param[param['type']]
+
+
+class WhatsappOutbox(models.Model):
+    _name = 'whatsapp.outbox'
+    _description = 'WhatsApp Outbound Queue'
+    _order = 'id desc'
+
+    state = fields.Selection([
+        ('queued', 'Queued'),
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ], string='Status', default='queued', required=True, index=True, readonly=True)
+    message_type = fields.Selection([
+        ('template', 'Template'),
+        ('text', 'Text'),
+        ('media', 'Media'),
+    ], string='Type', required=True, readonly=True)
+    to_number = fields.Char(string='To (E.164)', required=True, readonly=True)
+    account_id = fields.Many2one('whatsapp.account', string='Sent From', required=True, ondelete='cascade', readonly=True)
+    payload = fields.Text(
+        string='Payload', readonly=True,
+        help="JSON body posted to the /messages endpoint. "
+             "For media messages the uploaded media id is filled in at send time."
+    )
+    attachment_id = fields.Many2one('ir.attachment', string='Attachment', ondelete='set null', readonly=True)
+    template_id = fields.Many2one('whatsapp.template', string='Template', ondelete='set null', readonly=True)
+
+    # Where to log the result in chatter
+    res_model = fields.Char(string='Related Model', readonly=True)
+    res_id = fields.Integer(string='Related Record', readonly=True)
+    log_body = fields.Html(string='Chatter Log', sanitize=False, readonly=True)
+
+    attempts = fields.Integer(string='Attempts', default=0, readonly=True)
+    next_attempt = fields.Datetime(string='Next Attempt', default=fields.Datetime.now, index=True, readonly=True)
+    sent_date = fields.Datetime(string='Sent On', readonly=True)
+    wa_message_id = fields.Char(string='WhatsApp Message ID', readonly=True)
+    last_error = fields.Text(string='Last Error', readonly=True)
+    dedupe_key = fields.Char(string='Idempotency Key', readonly=True, copy=False)
+
+    def init(self):
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS whatsapp_outbox_dedupe_key_uniq
+                ON whatsapp_outbox (dedupe_key) WHERE dedupe_key IS NOT NULL
+        """)
+
+    # ---------- enqueue ----------
+    @api.model
+    def _enqueue(self, vals_list, dedupe=False):
+        """Queue one or more outbound messages; the cron does the actual Graph API calls.
+        Messages without an ``account_id`` go out from the default routing.
+        With ``dedupe`` (interactive sends), a message identical to one queued
+        within the dedupe window is not queued again: the original is returned."""
+        Account = self.env['whatsapp.account']
+        for vals in vals_list:
+            if isinstance(vals.get('payload'), dict):
+                vals['payload'] = json.dumps(vals['payload'])
+            if not vals.get('account_id'):
+                vals['account_id'] = Account._route().id
+        if dedupe:
+            return self.sudo()._enqueue_once(vals_list)
+        return self.sudo().create(vals_list)
+
+    def _dedupe_digest(self, vals):
+        """Hash of what the customer receives: recipient, template or text
+        (the payload), and the content of the attached file."""
+        checksum = ''
+        if vals.get('attachment_id'):
+            checksum = self.env['ir.attachment'].sudo().browse(vals['attachment_id']).checksum or ''
+        content = '\x1f'.join([vals.get('to_number') or '', vals.get('message_type') or '',
+                                vals.get('payload') or '', checksum])
+        return hashlib.sha1(content.encode()).hexdigest()
+
+    def _enqueue_once(self, vals_list):
+        """
+        Create the messages whose idempotency key (content digest + time
+        bucket) is not already queued. Keys of the current and previous
+        buckets are looked up, so a double-click straddling a bucket boundary
+        is still caught. An advisory lock per digest makes a concurrent twin
+        (the other click, still in flight) back off, and the unique index on
+        dedupe_key catches a twin committed after this transaction began.
+        """
+        window = int(self.env['ir.config_parameter'].sudo().get_param(
+            'whatsapp_meta.dedupe_window_seconds', DEDUPE_WINDOW_SECONDS))
+        bucket = int(time.time() // max(window, 1))
+        messages = self.browse()
+        for vals in vals_list:
+            digest = self._dedupe_digest(vals)
+            keys = ['%s:%s' % (digest, bucket), '%s:%s' % (digest, bucket - 1)]
+            self.env.cr.execute("SELECT pg_try_advisory_xact_lock(%s, hashtext(%s))",
+                                (OUTBOX_LOCK_NAMESPACE, digest))
+            original = self.browse()
+            if self.env.cr.fetchone()[0]:
+                original = self.search([('dedupe_key', 'in', keys)], limit=1)
+                if not original:
+                    try:
+                        with mute_logger('odoo.sql_db'), self.env.cr.savepoint():
+                            messages |= self.create(dict(vals, dedupe_key=keys[0]))
+                        continue
+                    except psycopg2.IntegrityError:
+                        pass
+            _logger.info("Duplicate WhatsApp %s to %s not queued (original: %s)",
+                         vals.get('message_type'), vals.get('to_number'), original.id or 'in flight')
+            metrics.inc('whatsapp_outbox_duplicates_total')
+            messages |= original
+        return messages
+
+    def action_retry(self):
+        self.filtered(lambda m: m.state == 'failed').write({
+            'state': 'queued',
+            'attempts': 0,
+            'next_attempt': fields.Datetime.now(),
+            'last_error': False,
+        })
+
+    # ---------- Graph API helpers ----------
+    def _wa_media_content(self, attachment):
+        """Return the upload arguments of an ir.attachment: its filestore path when it
+        has one (streamed by the client, never loaded in memory), else its bytes."""
+        filename = attachment.name or 'file'
+        mimetype = attachment.mimetype or (mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        if attachment.file_size > MAX_MEDIA_BYTES:
+            raise WhatsAppApiError(_("File %s is too large to send (>%s MB).") % (filename, 100))
+        media = {'filename': filename, 'mimetype': mimetype}
+        if attachment.store_fname:
+            media['path'] = attachment._full_path(attachment.store_fname)
+        else:
+            media['content'] = base64.b64decode(attachment.datas or b'')
+        return media
+
+    def _prepare_job(self, client):
+        """Collect, inside the ORM, everything a worker thread needs to send this message.
+        Files (media messages, template document headers) already uploaded for
+        this phone number reuse their cached media id."""
+        self.ensure_one()
+        job = {'id': self.id, 'to': self.to_number, 'payload': json.loads(self.payload or '{}'),
+               'media': None, 'media_id': None, 'checksum': None}
+        if self.message_type == 'media' or self.attachment_id:
+            attachment = self.attachment_id
+            if not attachment:
+                raise WhatsAppApiError(_("The attachment to send no longer exists."))
+            job['checksum'] = attachment.checksum
+            job['media_id'] = self.env['whatsapp.media']._get_media_id(attachment.checksum, client.phone_number_id)
+            if not job['media_id']:
+                job['media'] = self._wa_media_content(attachment)
+        return job
+
+    @staticmethod
+    def _execute_jobs(client, jobs, upload_executor):
+        """
+        Send the jobs of one recipient. Runs in a worker thread: no ORM access here.
+        All uploads of the chain start at once on ``upload_executor``; the
+        messages are then sent in their queued order, each waiting only for its
+        own upload. A failed upload fails that message alone.
+        Returns [(outbox id, wa message id, error, newly uploaded media id)].
+        """
+        uploads = {
+            job['id']: upload_executor.submit(client.upload_media, **job['media'])
+            for job in jobs if job['media'] and not job['media_id']
+        }
+        results = []
+        for job in jobs:
+            uploaded = None
+            try:
+                payload = job['payload']
+                if job['id'] in uploads:
+                    uploaded = uploads[job['id']].result()
+                if job['media_id'] or uploaded:
+                    _media_block(payload)['id'] = job['media_id'] or uploaded
+                _logger.info("Sending WhatsApp %s to %s", payload.get('type'), job['to'])
+                results.append((job['id'], client.send_message(payload), None, uploaded))
+            except WhatsAppApiError as e:
+                results.append((job['id'], None, e, uploaded))
+            except Exception as e:
+                _logger.exception("Unexpected error sending WhatsApp message %s", job['id'])
+                results.append((job['id'], None, WhatsAppApiError(str(e)), uploaded))
+        return results
+
+    def _apply_results(self, jobs_by_id, results):
+        """Record the outcome of a whole batch, given as (client, result) pairs.
+        Returns the whatsapp.message values of the messages that left the queue."""
+        Media = self.env['whatsapp.media']
+        log = []
+        for client, (message_id, wa_message_id, error, uploaded) in results:
+            job = jobs_by_id[message_id]
+            if uploaded:
+                Media._store(job['checksum'], client.phone_number_id, uploaded)
+            elif error and job['media_id'] and not error.retryable and error.code in MEDIA_ERROR_CODES:
+                # Meta rejected the cached id (purged or invalid): upload again on retry.
+                # Throttling, 5xx and network errors keep it.
+                Media._evict(job['checksum'], client.phone_number_id)
+                error.retryable = True
+            message = self.browse(message_id)
+            if error:
+                message._mark_error(error)
+            else:
+                message._mark_sent(wa_message_id)
+            if message.state != 'queued':
+                log.append(message._message_log_vals(job['payload']))
+        return log
+
+    def _log_results(self, log, auto_commit=True):
+        """
+        Write the message log and conversations of a batch whose outbox state
+        is already committed, and refresh the touched leads. The inbox cron
+        may write the same rows (a status webhook, a customer reply) after
+        this transaction's snapshot, which fails the upsert with a
+        serialization error: it is retried in a fresh transaction, and if it
+        keeps failing only the log is lost, never the sent state (a rolled
+        back sent state would send the messages again).
+        """
+        if not log:
+            return
+        for attempt in range(1, LOG_ATTEMPTS + 1):
+            try:
+                with self.env.cr.savepoint():
+                    self.env['whatsapp.message']._log_outbound(log)
+                    # The chatter notes posted on send show up on open lead forms, once per lead
+                    self.env['crm.lead']._wa_notify_leads(
+                        [vals['lead_id'] for vals in log if vals['lead_id']], chatter=True)
+                return
+            except psycopg2.extensions.TransactionRollbackError as e:
+                if not auto_commit or attempt == LOG_ATTEMPTS:
+                    _logger.warning("Could not log %s sent WhatsApp messages: %s", len(log), e)
+                    return
+                # Nothing else is pending: start over with a fresh snapshot
+                self.env.cr.rollback()
+                self.env.clear()
+
+    def _message_log_vals(self, payload):
+        """whatsapp.message values of a sent or definitively failed message."""
+        self.ensure_one()
+        record = self._related_record()
+        lead = record if record is not None and record._name == 'crm.lead' else None
+        if record is not None and record._name == 'res.partner':
+            partner = record
+        else:
+            partner = record.partner_id if record is not None and 'partner_id' in record._fields else None
+        wa_type = payload.get('type')
+        content = payload.get(wa_type) or {}
+        return {
+            'wamid': self.wa_message_id,
+            'direction': 'out',
+            'account_id': self.account_id.id,
+            'number': self.to_number,
+            'lead_id': lead.id if lead else None,
+            'partner_id': partner.id if partner else None,
+            'template_id': self.template_id.id,
+            'message_type': wa_type,
+            'body': content.get('body') or content.get('name') or content.get('caption') or content.get('filename'),
+            'state': 'sent' if self.state == 'sent' else 'failed',
+            'sent_date': self.sent_date,
+            'failed_date': fields.Datetime.now() if self.state == 'failed' else None,
+            'error': self.last_error,
+        }
+
+    # ---------- result handling ----------
+    def _related_record(self):
+        self.ensure_one()
+        if not self.res_model or not self.res_id or self.res_model not in self.env:
+            return None
+        record = self.env[self.res_model].browse(self.res_id).exists()
+        if not record or not hasattr(record, 'message_post'):
+            return None
+        return record
+
+    def _mark_sent(self, wa_message_id):
+        self.write({
+            'state': 'sent',
+            'attempts': self.attempts + 1,
+            'sent_date': fields.Datetime.now(),
+            'wa_message_id': wa_message_id,
+            'last_error': False,
+        })
+        metrics.inc('whatsapp_outbox_messages_total', result='sent')
+        record = self._related_record()
+        if record and self.log_body:
+            record.message_post(body=self.log_body, message_type='comment', subtype_xmlid='mail.mt_note')
+
+    def _mark_error(self, error):
+        attempts = self.attempts + 1
+        if error.retryable and attempts < MAX_ATTEMPTS:
+            delay = BACKOFF_SECONDS * (2 ** (attempts - 1))
+            self.write({
+                'attempts': attempts,
+                'next_attempt': fields.Datetime.now() + timedelta(seconds=delay),
+                'last_error': str(error),
+            })
+            _logger.warning("WhatsApp send to %s failed (attempt %s), retrying in %ss: %s",
+                            self.to_number, attempts, delay, error)
+            metrics.inc('whatsapp_outbox_retries_total')
+            return
+        self.write({'state': 'failed', 'attempts': attempts, 'last_error': str(error)})
+        _logger.error("WhatsApp send to %s failed: %s", self.to_number, error)
+        metrics.inc('whatsapp_outbox_messages_total', result='failed')
+        record = self._related_record()
+        if record:
+            record.message_post(
+                body=_("❌ WhatsApp %s to <b>%s</b> failed: %s") % (self.message_type, self.to_number, error),
+                message_type='comment', subtype_xmlid='mail.mt_note',
+            )
+
+    # ---------- cron ----------
+    @api.model
+    def _cron_process_queue(self, batch_size=200, time_budget=240):
+        """
+        Drain due messages in batches until the queue is empty or the time
+        budget is spent. Rows are locked with SKIP LOCKED so overlapping runs
+        never pick the same message twice. Recipients are sent to concurrently
+        (each recipient's messages stay in order), each account paced by its
+        own shared token bucket (whatsapp.rate.limit), so traffic spread over
+        several numbers is not held back by a single number's tier.
+        """
+        auto_commit = not getattr(threading.currentThread(), 'testing', False)
+        RateLimit = self.env['whatsapp.rate.limit']
+        rate = RateLimit._messages_per_second()
+        ICP = self.env['ir.config_parameter'].sudo()
+        concurrency = int(ICP.get_param('whatsapp_meta.send_concurrency', 8))
+        upload_concurrency = int(ICP.get_param('whatsapp_meta.upload_concurrency', 4))
+        clients = {}
+        started = time.time()
+
+        with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor, \
+                ThreadPoolExecutor(max_workers=max(upload_concurrency, 1)) as upload_executor:
+            while time.time() - started < time_budget:
+                self.env.cr.execute("""
+                    SELECT id FROM whatsapp_outbox
+                     WHERE state = 'queued' AND next_attempt <= (now() at time zone 'UTC')
+                     ORDER BY id
+                     LIMIT %s
+                       FOR UPDATE SKIP LOCKED
+                """, (batch_size,))
+                ids = [row[0] for row in self.env.cr.fetchall()]
+                if not ids:
+                    break
+
+                # account -> recipient -> ordered jobs
+                chains = OrderedDict()
+                jobs_by_id = {}
+                for message in self.browse(ids):
+                    # Rows queued before accounts existed go out from the default routing
+                    account = message.account_id or self.env['whatsapp.account']._route()
+                    if account.id not in clients:
+                        clients[account.id] = account._client()
+                    try:
+                        job = message._prepare_job(clients[account.id])
+                    except WhatsAppApiError as e:
+                        message._mark_error(e)
+                        continue
+                    jobs_by_id[job['id']] = job
+                    chains.setdefault(account.id, OrderedDict()).setdefault(message.to_number, []).append(job)
+
+                futures = []
+                pending = {account_id: list(by_number.values()) for account_id, by_number in chains.items()}
+                credit = dict.fromkeys(pending, 0)
+                while pending:
+                    waits = []
+                    for account_id in list(pending):
+                        client, account_chains = clients[account_id], pending[account_id]
+                        needed = sum(len(chain) for chain in account_chains) - credit[account_id]
+                        granted, wait = RateLimit._acquire(client.phone_number_id, needed, rate)
+                        credit[account_id] += granted
+                        while account_chains and credit[account_id] >= len(account_chains[0]):
+                            chain = account_chains.pop(0)
+                            credit[account_id] -= len(chain)
+                            futures.append((client, executor.submit(self._execute_jobs, client, chain, upload_executor)))
+                        if account_chains:
+                            waits.append(wait)
+                        else:
+                            del pending[account_id]
+                    if pending:
+                        time.sleep(max(min(waits), 0.05))
+
+                log = self._apply_results(jobs_by_id, [
+                    (client, result) for client, future in futures for result in future.result()])
+                if auto_commit:
+                    self.env.cr.commit()
+                self._log_results(log, auto_commit)
+                if auto_commit:
+                    self.env.cr.commit()
+        metrics.observe('whatsapp_cron_seconds', time.time() - started, job='outbox')
+        self.env['whatsapp.metrics.snapshot']._flush()
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# whatsapp_meta_integration/models/whatsapp_phone_mixin.py
+import logging
+
+from odoo import api, fields, models
+from odoo.tools.sql import column_exists, create_column, table_exists
+
+from ..tools.phone import phone_key, phone_key_sql
+
+_logger = logging.getLogger(__name__)
+
+
+class WhatsappPhoneMixin(models.AbstractModel):
+    """Stored, indexed phone keys on models having ``phone`` and ``mobile``,
+    so an inbound sender resolves with an indexed equality lookup instead
+    of an ``ilike`` scan."""
+    _name = 'whatsapp.phone.mixin'
+    _description = 'WhatsApp Phone Key Mixin'
+
+    wa_mobile_key = fields.Char(
+        string='WA Mobile Key', compute='_compute_wa_phone_keys', store=True, index=True, readonly=True)
+    wa_phone_key = fields.Char(
+        string='WA Phone Key', compute='_compute_wa_phone_keys', store=True, index=True, readonly=True)
+
+    @api.depends('mobile', 'phone')
+    def _compute_wa_phone_keys(self):
+        for record in self:
+            record.wa_mobile_key = phone_key(record.mobile)
+            record.wa_phone_key = phone_key(record.phone)
+
+    def _auto_init(self):
+        # Create the columns ourselves so the ORM does not recompute the keys
+        # record by record on install; a single UPDATE fills them instead.
+        cr = self.env.cr
+        if not self._auto or not table_exists(cr, self._table):
+            return super()._auto_init()
+        missing = [name for name in ('wa_mobile_key', 'wa_phone_key') if not column_exists(cr, self._table, name)]
+        for name in missing:
+            create_column(cr, self._table, name, 'varchar')
+        if missing:
+            self._wa_backfill_phone_keys()
+        return super()._auto_init()
+
+    @api.model
+    def _wa_backfill_phone_keys(self):
+        """Recompute every phone key in SQL; only rows whose key changed are written."""
+        mobile_expr = phone_key_sql('mobile')
+        phone_expr = phone_key_sql('phone')
+        self.env.cr.execute("""
+            UPDATE {table}
+               SET wa_mobile_key = {mobile_expr},
+                   wa_phone_key = {phone_expr}
+             WHERE wa_mobile_key IS DISTINCT FROM {mobile_expr}
+                OR wa_phone_key IS DISTINCT FROM {phone_expr}
+        """.format(table=self._table, mobile_expr=mobile_expr, phone_expr=phone_expr))
+        _logger.info("Backfilled WhatsApp phone keys on %s rows of %s", self.env.cr.rowcount, self._table)
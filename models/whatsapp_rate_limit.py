@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# whatsapp_meta_integration/models/whatsapp_rate_limit.py
+import logging
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+# Meta's default throughput tier for a business phone number
+DEFAULT_MESSAGES_PER_SECOND = 80
+
+
+class WhatsappRateLimit(models.Model):
+    """
+    Token bucket per phone number, stored in the database so every Odoo
+    worker (and every cron thread) draws from the same budget.
+    """
+    _name = 'whatsapp.rate.limit'
+    _description = 'WhatsApp Send Rate Limit'
+    _log_access = False
+
+    key = fields.Char(required=True, readonly=True)
+    tokens = fields.Float(readonly=True)
+    updated_at = fields.Datetime(readonly=True)
+
+    _sql_constraints = [
+        ('key_uniq', 'unique(key)', 'Only one rate limit bucket per key.'),
+    ]
+
+    @api.model
+    def _messages_per_second(self):
+        rate = self.env['ir.config_parameter'].sudo().get_param('whatsapp_meta.messages_per_second')
+        try:
+            return max(float(rate), 0.1) if rate else DEFAULT_MESSAGES_PER_SECOND
+        except ValueError:
+            return DEFAULT_MESSAGES_PER_SECOND
+
+    @api.model
+    def _acquire(self, key, count, rate):
+        """
+        Take up to ``count`` tokens from the bucket of ``key`` refilled at
+        ``rate`` tokens/second (burst: one second worth of tokens).
+        Runs in its own short transaction so other workers see it at once.
+        Returns (granted, seconds to wait before the next token).
+        """
+        burst = max(rate, 1.0)
+        with self.pool.cursor() as cr:
+            cr.execute("""
+                INSERT INTO whatsapp_rate_limit (key, tokens, updated_at)
+                VALUES (%s, %s, clock_timestamp() at time zone 'UTC')
+                ON CONFLICT (key) DO NOTHING
+            """, (key, burst))
+            cr.execute("""
+                SELECT tokens, EXTRACT(EPOCH FROM (clock_timestamp() at time zone 'UTC') - updated_at)
+                  FROM whatsapp_rate_limit
+                 WHERE key = %s
+                   FOR UPDATE
+            """, (key,))
+            tokens, elapsed = cr.fetchone()
+            tokens = min(burst, (tokens or 0.0) + max(elapsed or 0.0, 0.0) * rate)
+            granted = min(count, int(tokens))
+            tokens -= granted
+            cr.execute("""
+                UPDATE whatsapp_rate_limit
+                   SET tokens = %s, updated_at = clock_timestamp() at time zone 'UTC'
+                 WHERE key = %s
+            """, (tokens, key))
+        wait = 0.0 if granted >= count else (1.0 - tokens) / rate
+        return granted, wait
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+# whatsapp_meta_integration/models/whatsapp_response_report.py
+import logging
+import re
+import threading
+import time
+from datetime import timedelta
+
+from odoo import api, fields, models
+
+from ..tools import metrics
+from .crm_lead import REPLY_WINDOW_HOURS
+from .whatsapp_message import ARCHIVE_TABLE
+
+_logger = logging.getLogger(__name__)
+
+# Messages committed late (long transactions) are caught by re-reading this far back
+REFRESH_OVERLAP_MINUTES = 10
+REFRESH_CHUNK = 1000
+
+# One row per customer turn: the inbound messages received since our last
+# reply, up to our next reply. Conversations are numbers (digits only) per
+# account, as in whatsapp.conversation. Message ids are kept in the archive,
+# so the id of a turn's first message identifies the turn.
+TURNS_QUERY = """
+    WITH messages AS (
+        SELECT id, regexp_replace(number, '[^0-9]', '', 'g') AS number, COALESCE(account_id, 0) AS account_key,
+               account_id, lead_id, direction,
+               CASE WHEN direction = 'in' THEN received_date ELSE sent_date END AS date
+          FROM (SELECT id, number, account_id, lead_id, direction, received_date, sent_date
+                  FROM whatsapp_message
+                UNION ALL
+                SELECT id, number, account_id, lead_id, direction, received_date, sent_date
+                  FROM {archive}) m
+         WHERE {where}
+    ), flagged AS (
+        SELECT *,
+               CASE WHEN direction = 'in' AND LAG(direction) OVER w IS DISTINCT FROM 'in' THEN 1 ELSE 0 END AS turn_start,
+               MIN(CASE WHEN direction = 'out' THEN date END)
+                   OVER (PARTITION BY number, account_key ORDER BY date DESC, id DESC) AS next_reply
+          FROM messages
+         WHERE date IS NOT NULL
+        WINDOW w AS (PARTITION BY number, account_key ORDER BY date, id)
+    ), turns AS (
+        SELECT *, SUM(turn_start) OVER (PARTITION BY number, account_key ORDER BY date, id) AS turn
+          FROM flagged
+    ), inbound AS (
+        SELECT (array_agg(id ORDER BY date, id))[1] AS message_id,
+               number,
+               MAX(account_id) AS account_id,
+               (array_agg(lead_id ORDER BY date DESC, id DESC) FILTER (WHERE lead_id IS NOT NULL))[1] AS lead_id,
+               COUNT(*) AS inbound_count,
+               MIN(date) AS received_date,
+               MAX(date) AS last_inbound_date,
+               MIN(next_reply) AS response_date
+          FROM turns
+         WHERE direction = 'in'
+         GROUP BY number, account_key, turn
+    )
+    INSERT INTO whatsapp_response_report
+           (message_id, number, account_id, lead_id, user_id, team_id, inbound_count,
+            received_date, reply_deadline, response_date, response_hours, in_window_rate, state, refreshed_date)
+    SELECT i.message_id, i.number, i.account_id, i.lead_id, l.user_id, l.team_id, i.inbound_count,
+           i.received_date, i.last_inbound_date + interval '1 hour' * %(hours)s, i.response_date,
+           EXTRACT(EPOCH FROM i.response_date - i.received_date) / 3600.0,
+           CASE WHEN i.response_date <= i.last_inbound_date + interval '1 hour' * %(hours)s THEN 100.0
+                WHEN i.response_date IS NOT NULL
+                  OR i.last_inbound_date + interval '1 hour' * %(hours)s <= %(now)s THEN 0.0
+           END,
+           CASE WHEN i.response_date <= i.last_inbound_date + interval '1 hour' * %(hours)s THEN 'in_window'
+                WHEN i.response_date IS NOT NULL THEN 'late'
+                WHEN i.last_inbound_date + interval '1 hour' * %(hours)s <= %(now)s THEN 'unanswered'
+                ELSE 'open'
+           END,
+           NULL
+      FROM inbound i
+      LEFT JOIN crm_lead l ON l.id = i.lead_id
+"""
+
+
+class WhatsappResponseReport(models.Model):
+    """
+    First-response times and reply-window compliance, one row per customer
+    turn. Filled in SQL by a cron that only recomputes the conversations
+    with new messages (or whose open turn's window has since expired), so
+    the pivot and graph views read plain indexed rows. The salesperson and
+    team are those of the lead when its conversation was last recomputed.
+    The last run's time is kept on the rows (refreshed_date), not in
+    ir.config_parameter, whose writes clear every worker's caches.
+    """
+    _name = 'whatsapp.response.report'
+    _description = 'WhatsApp Response Time Report'
+    _order = 'received_date desc'
+    _rec_name = 'number'
+    _log_access = False
+
+    message_id = fields.Integer(string='First Message', readonly=True)
+    number = fields.Char(string='Customer Number', index=True, readonly=True)
+    account_id = fields.Many2one('whatsapp.account', string='Account', readonly=True)
+    lead_id = fields.Many2one('crm.lead', string='Lead', readonly=True)
+    user_id = fields.Many2one('res.users', string='Salesperson', index=True, readonly=True)
+    team_id = fields.Many2one('crm.team', string='Sales Team', index=True, readonly=True)
+    inbound_count = fields.Integer(string='Inbound Messages', readonly=True)
+    received_date = fields.Datetime(string='Received On', index=True, readonly=True)
+    reply_deadline = fields.Datetime(string='Reply Deadline', readonly=True)
+    response_date = fields.Datetime(string='Answered On', readonly=True)
+    response_hours = fields.Float(string='First Response (h)', group_operator='avg', readonly=True)
+    in_window_rate = fields.Float(
+        string='% Answered in Window', group_operator='avg', readonly=True,
+        help="100 when answered inside the 24h window, 0 when answered late or not at all. "
+             "Empty while the window is still open, so pending turns do not lower the average.")
+    state = fields.Selection([
+        ('in_window', 'Answered in Window'),
+        ('late', 'Answered Late'),
+        ('unanswered', 'Unanswered'),
+        ('open', 'Awaiting Reply'),
+    ], string='Status', index=True, readonly=True)
+    refreshed_date = fields.Datetime(
+        string='Refreshed On', index=True, readonly=True,
+        help="Time of the cron run that recomputed this line; empty until that run completes.")
+
+    _sql_constraints = [
+        ('message_id_uniq', 'unique(message_id)', 'One report line per customer turn.'),
+    ]
+
+    # ---------- refresh ----------
+    @api.model
+    def _recompute(self, numbers=None):
+        """Rebuild the turns of the given conversation numbers (digits only), or of all of them."""
+        cr = self.env.cr
+        params = {'hours': REPLY_WINDOW_HOURS, 'now': fields.Datetime.now()}
+        if numbers is None:
+            cr.execute("DELETE FROM whatsapp_response_report")
+            where = "TRUE"
+        else:
+            cr.execute("DELETE FROM whatsapp_response_report WHERE number = ANY(%s)", (list(numbers),))
+            # Inbound numbers come without '+', outbound ones with it: match both on the raw, indexed column
+            where = "m.number = ANY(%(numbers)s)"
+            params['numbers'] = list(numbers) + ['+' + number for number in numbers]
+        cr.execute(TURNS_QUERY.format(archive=ARCHIVE_TABLE, where=where), params)
+        return cr.rowcount
+
+    @api.model
+    def _cron_refresh(self):
+        """Recompute the conversations touched since the last completed run,
+        the latest refreshed_date of the report. The first run (or an empty
+        report) rebuilds everything, archive included. Lines are stamped only
+        once the whole run is done, so an interrupted run is redone from the
+        previous mark."""
+        auto_commit = not getattr(threading.currentThread(), 'testing', False)
+        cr = self.env.cr
+        started = time.time()
+        now = fields.Datetime.now()
+        cr.execute("SELECT MAX(refreshed_date) FROM whatsapp_response_report")
+        since = cr.fetchone()[0]
+
+        if not since:
+            turns = self._recompute()
+        else:
+            since -= timedelta(minutes=REFRESH_OVERLAP_MINUTES)
+            cr.execute("""
+                SELECT DISTINCT regexp_replace(number, '[^0-9]', '', 'g')
+                  FROM whatsapp_message
+                 WHERE write_date >= %s AND number IS NOT NULL
+                 UNION
+                SELECT number FROM whatsapp_response_report
+                 WHERE state = 'open' AND reply_deadline <= %s
+            """, (since, now))
+            numbers = sorted({re.sub(r'\D', '', row[0] or '') for row in cr.fetchall()} - {''})
+            turns = 0
+            for index in range(0, len(numbers), REFRESH_CHUNK):
+                turns += self._recompute(numbers[index:index + REFRESH_CHUNK])
+                if auto_commit:
+                    cr.commit()
+        cr.execute("UPDATE whatsapp_response_report SET refreshed_date = %s WHERE refreshed_date IS NULL", (now,))
+        _logger.info("WhatsApp response report: %s turns recomputed in %.2fs", turns, time.time() - started)
+        metrics.observe('whatsapp_cron_seconds', time.time() - started, job='response_report')
+        self.env['whatsapp.metrics.snapshot']._flush()
@@ -1,12 +1,77 @@
 #Author: Noureldin ElDehy
 # whatsapp_meta_integration/models/whatsapp_template.py
-from odoo import models, fields
+import hashlib
+import json
+import logging
+import re
+import time
+
+from odoo import api, models, fields, tools, _
+from odoo.exceptions import UserError
+
+from ..tools import metrics
+
+_logger = logging.getLogger(__name__)
+
+SYNC_BATCH_SIZE = 500
+PLACEHOLDER_RE = re.compile(r'\{\{\s*([a-zA-Z0-9_]+)\s*\}\}')
+MEDIA_HEADER_FORMATS = ('IMAGE', 'VIDEO', 'DOCUMENT')
+
+
+def _placeholders(text, named):
+    """Parameter slots of a component text, in send order: names for named
+    templates, None for each positional {{n}} (sorted by n)."""
+    found = PLACEHOLDER_RE.findall(text or '')
+    if named:
+        return list(dict.fromkeys(found))
+    return [None] * len({p for p in found if p.isdigit()})
+
+
+def _compile_components(components, parameter_format):
+    """Precompile Meta template components into the slots a send has to fill."""
+    named = parameter_format == 'NAMED'
+    compiled = {'named': named, 'header': None, 'body': [], 'buttons': []}
+    for component in components:
+        ctype = (component.get('type') or '').upper()
+        if ctype == 'HEADER':
+            fmt = (component.get('format') or 'TEXT').upper()
+            if fmt == 'TEXT':
+                params = _placeholders(component.get('text'), named)
+                if params:
+                    compiled['header'] = {'format': 'TEXT', 'param': params[0]}
+            elif fmt in MEDIA_HEADER_FORMATS:
+                compiled['header'] = {'format': fmt, 'param': None}
+        elif ctype == 'BODY':
+            compiled['body'] = _placeholders(component.get('text'), named)
+        elif ctype == 'BUTTONS':
+            for index, button in enumerate(component.get('buttons') or []):
+                btype = (button.get('type') or '').upper()
+                example = button.get('example') or ['']
+                example = example[0] if isinstance(example, list) and example else example
+                url = button.get('url') or ''
+                if btype == 'URL' and PLACEHOLDER_RE.search(url):
+                    # Meta's example is the full URL; the parameter is only the dynamic suffix
+                    prefix = url[:url.index('{{')]
+                    if example and example.startswith(prefix):
+                        example = example[len(prefix):]
+                    compiled['buttons'].append({'index': index, 'sub_type': 'url', 'param_type': 'text',
+                                                'example': example or ''})
+                elif btype == 'COPY_CODE':
+                    compiled['buttons'].append({'index': index, 'sub_type': 'copy_code',
+                                                'param_type': 'coupon_code', 'example': example or ''})
+    return compiled
+
 
 class WhatsappTemplate(models.Model):
     _name = 'whatsapp.template'
     _description = 'WhatsApp Message Template'
     _order = 'name'
 
+    active = fields.Boolean(
+        default=True,
+        help="Templates no longer approved on Meta are archived by the sync."
+    )
+
     name = fields.Char(
         string='Template Name', 
         required=True, 
@@ -45,4 +110,236 @@ class WhatsappTemplate(models.Model):
         string="Header Type", 
         readonly=True, 
         help="DOCUMENT, IMAGE, VIDEO, or TEXT"
-    )
\ No newline at end of file
+    )
+    parameter_format = fields.Selection([
+        ('POSITIONAL', 'Positional'),
+        ('NAMED', 'Named'),
+    ], string="Parameter Format", default='POSITIONAL', readonly=True)
+    components_json = fields.Text(
+        string="Components",
+        readonly=True,
+        help="Template components as received from Meta."
+    )
+    compiled_payload = fields.Text(
+        string="Compiled Payload",
+        compute='_compute_compiled_payload',
+        store=True,
+        help="Precompiled send structure: header format, ordered body parameters and button slots."
+    )
+    sync_hash = fields.Char(
+        string="Sync Hash",
+        readonly=True,
+        copy=False,
+        help="Digest of the template as last received from Meta; unchanged templates are skipped on sync."
+    )
+    meta_template_id = fields.Char(
+        string="Meta Template ID",
+        readonly=True,
+        copy=False,
+        help="Set on templates synced from Meta; templates created by hand have none and are never archived by the sync."
+    )
+    waba_id = fields.Char(
+        string="WABA ID",
+        readonly=True,
+        copy=False,
+        help="WhatsApp Business Account the template was synced from."
+    )
+
+    @api.depends('components_json', 'parameter_format', 'body_text', 'header_type', 'has_header_variable')
+    def _compute_compiled_payload(self):
+        for template in self:
+            if template.components_json:
+                components = json.loads(template.components_json)
+            else:
+                # Templates entered by hand: rebuild components from the fields
+                components = [{'type': 'BODY', 'text': template.body_text or ''}]
+                if template.has_header_variable:
+                    header_format = (template.header_type or 'TEXT').upper()
+                    components.append({'type': 'HEADER', 'format': header_format,
+                                       'text': '{{1}}' if header_format == 'TEXT' else ''})
+            template.compiled_payload = json.dumps(_compile_components(components, template.parameter_format))
+
+    @tools.ormcache('self.id', 'self.compiled_payload')
+    def _get_compiled(self):
+        """Parsed compiled_payload, cached per template version. Treat as read-only."""
+        return json.loads(self.compiled_payload or '{}')
+
+    def _button_slots(self):
+        """[(button index, label)] of the dynamic buttons a send has to fill."""
+        self.ensure_one()
+        return [
+            (button['index'], _("Coupon code") if button['sub_type'] == 'copy_code'
+             else _("Button %s URL suffix") % (button['index'] + 1))
+            for button in self._get_compiled().get('buttons', [])
+        ]
+
+    # ---------- sending ----------
+    def _build_send_payload(self, to_e164, header_value=None, body_values=(), button_values=None,
+                            header_media=None):
+        """Return the /messages payload sending this template to ``to_e164``.
+        Only fills the slots precompiled at sync time; no template parsing here.
+        ``header_media`` (e.g. {'filename': ...}) replaces the link of a media
+        header whose file the outbox uploads: it fills in the media id at send time."""
+        self.ensure_one()
+        compiled = self._get_compiled()
+        components = []
+        header = compiled.get('header')
+        if header:
+            media_header = header['format'] != 'TEXT'
+            if not header_value and not (media_header and header_media is not None):
+                raise UserError(_("Please provide a value for the Header Variable."))
+            if not media_header:
+                param = {"type": "text", "text": header_value}
+                if header['param']:
+                    param['parameter_name'] = header['param']
+            else:
+                media_type = header['format'].lower()
+                block = dict(header_media) if header_media is not None else {"link": header_value}
+                param = {"type": media_type, media_type: block}
+            components.append({"type": "header", "parameters": [param]})
+        if compiled.get('body') and body_values:
+            body_params = []
+            for name, value in zip(compiled['body'], body_values):
+                param = {"type": "text", "text": value or ""}
+                if name:
+                    param['parameter_name'] = name
+                body_params.append(param)
+            components.append({"type": "body", "parameters": body_params})
+        for button in compiled.get('buttons', []):
+            # Never fall back to Meta's review example: it would reach real customers
+            value = (button_values or {}).get(button['index'])
+            if not value:
+                raise UserError(_("Please provide a value for the dynamic button %s of template %s.")
+                                % (button['index'] + 1, self.name))
+            components.append({
+                "type": "button",
+                "sub_type": button['sub_type'],
+                "index": str(button['index']),
+                "parameters": [{"type": button['param_type'], button['param_type']: value}],
+            })
+        payload = {"messaging_product": "whatsapp", "to": to_e164, "type": "template", "template": {"name": self.name, "language": {"code": self.language_code},},}
+        if components:
+            payload["template"]["components"] = components
+        return payload
+
+    # ---------- sync from Meta ----------
+    @api.model
+    def _vals_from_meta(self, tpl, waba_id=None):
+        """Convert a Graph API template into field values; the send structure
+        is compiled here once (see _compute_compiled_payload)."""
+        components = tpl.get('components', [])
+        parameter_format = tpl.get('parameter_format') or 'POSITIONAL'
+        compiled = _compile_components(components, parameter_format)
+        body_component = next((c for c in components if c['type'] == 'BODY'), None)
+        header_component = next((c for c in components if c['type'] == 'HEADER'), None)
+
+        return {
+            'name': tpl['name'],
+            'language_code': tpl['language'],
+            'body_text': body_component.get('text', '') if body_component else '',
+            'variable_count': len(compiled['body']),
+            'has_header_variable': bool(compiled['header']),
+            'header_type': header_component.get('format', 'TEXT') if header_component else '',
+            'parameter_format': parameter_format,
+            'components_json': json.dumps(components),
+            'meta_template_id': tpl.get('id'),
+            'waba_id': waba_id,
+        }
+
+    @staticmethod
+    def _meta_hash(tpl):
+        return hashlib.sha1(json.dumps(tpl, sort_keys=True).encode()).hexdigest()
+
+    @api.model
+    def _write_synced(self, updates):
+        """
+        Write the Meta values of changed templates, given as (id, vals) with
+        the same keys, with a single UPDATE. compiled_payload is compiled here
+        from the same components, instead of one ORM recompute and UPDATE
+        per template.
+        """
+        if not updates:
+            return
+        self.flush()
+        columns = list(updates[0][1])
+        rows = []
+        for template_id, vals in updates:
+            compiled = _compile_components(json.loads(vals['components_json']), vals['parameter_format'])
+            rows.append([template_id] + [vals[column] for column in columns] + [json.dumps(compiled)])
+        columns.append('compiled_payload')
+        placeholders = "(%s)" % ", ".join(["%s"] * (len(columns) + 1))
+        self.env.cr.execute("""
+            UPDATE whatsapp_template t
+               SET {assignments}, write_uid = %s, write_date = now() at time zone 'UTC'
+              FROM (VALUES {values}) AS v(id, {columns})
+             WHERE t.id = v.id
+        """.format(assignments=", ".join('"%s" = v."%s"' % (column, column) for column in columns),
+                   values=", ".join([placeholders] * len(rows)),
+                   columns=", ".join('"%s"' % column for column in columns)),
+            [self.env.uid] + [item for row in rows for item in row])
+        self.invalidate_cache(ids=[template_id for template_id, _vals in updates])
+
+    @api.model
+    def _sync_from_meta(self, clients):
+        """
+        Mirror the approved templates of one or more WABAs (one client each).
+        Existing templates are prefetched once, keyed by (name, language);
+        unchanged ones (same hash) are not written, new ones are created and
+        changed ones updated in batches, and templates synced from these WABAs
+        that are no longer approved in any of them are archived (templates
+        created by hand are left alone).
+        Returns a dict of counters.
+        """
+        started = time.time()
+        Template = self.with_context(active_test=False)
+        existing = {(t.name, t.language_code): t for t in Template.search([])}
+        counts = {'created': 0, 'updated': 0, 'unchanged': 0, 'archived': 0}
+        seen = set()
+        to_create = []
+        to_update = []
+
+        templates = ((client.waba_id, tpl) for client in clients for tpl in client.iter_templates())
+        for waba_id, tpl in templates:
+            if tpl.get('status') != 'APPROVED':
+                continue
+            key = (tpl['name'], tpl['language'])
+            if key in seen:
+                continue
+            seen.add(key)
+            digest = self._meta_hash(tpl)
+            template = existing.get(key)
+            if template and template.sync_hash == digest and template.active and template.meta_template_id:
+                counts['unchanged'] += 1
+                continue
+            vals = dict(self._vals_from_meta(tpl, waba_id), sync_hash=digest, active=True)
+            if template:
+                to_update.append((template.id, vals))
+                if len(to_update) >= SYNC_BATCH_SIZE:
+                    self._write_synced(to_update)
+                    counts['updated'] += len(to_update)
+                    to_update = []
+            else:
+                to_create.append(vals)
+                if len(to_create) >= SYNC_BATCH_SIZE:
+                    Template.create(to_create)
+                    counts['created'] += len(to_create)
+                    to_create = []
+        if to_create:
+            Template.create(to_create)
+            counts['created'] += len(to_create)
+        if to_update:
+            self._write_synced(to_update)
+            counts['updated'] += len(to_update)
+
+        synced_wabas = {client.waba_id for client in clients}
+        stale = Template.browse([t.id for key, t in existing.items()
+                                 if key not in seen and t.active and t.meta_template_id and t.waba_id in synced_wabas])
+        if stale:
+            stale.write({'active': False})
+            counts['archived'] = len(stale)
+        _logger.info("WhatsApp template sync: %s", counts)
+        metrics.observe('whatsapp_template_sync_seconds', time.time() - started)
+        for outcome, count in counts.items():
+            metrics.inc('whatsapp_template_sync_templates_total', count, outcome=outcome)
+        return counts
+
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+# whatsapp_meta_integration/models/whatsapp_variable_rule.py
+import logging
+
+from odoo import api, fields, models, tools, _
+from odoo.exceptions import ValidationError
+
+_logger = logging.getLogger(__name__)
+
+
+def _display_value_for_field(record, field_name):
+    """Return human-readable value from a record for any field type."""
+    if not field_name or field_name not in record._fields:
+        return ''
+    val = record[field_name]
+    if not val:
+        return ''
+    field_type = record._fields[field_name].type
+    if field_type == 'many2one':
+        return val.display_name or ''
+    if field_type == 'selection':
+        return dict(record._fields[field_name].selection).get(val, '')
+    if field_type in ('many2many', 'one2many'):
+        return ", ".join(val.mapped('display_name'))
+    return str(val)
+
+
+def _variable_labels(template):
+    """Label of each body variable, from the template's comma-separated descriptions."""
+    descriptions = [d.strip() for d in (template.variable_descriptions or '').split(',')] \
+        if template.variable_descriptions else []
+    return [descriptions[i - 1] if i <= len(descriptions) else f'Body Variable {{{i}}}'
+            for i in range(1, template.variable_count + 1)]
+
+
+class WhatsappVariableRule(models.Model):
+    """
+    How to auto-fill a template body variable from the record it is sent for.
+    A rule applies when every keyword group appears in the variable's
+    description (e.g. "agent, phone|mobile|whatsapp").
+    """
+    _name = 'whatsapp.variable.rule'
+    _description = 'WhatsApp Variable Auto-fill Rule'
+    _order = 'sequence, id'
+
+    name = fields.Char(string='Name', required=True)
+    sequence = fields.Integer(default=10)
+    active = fields.Boolean(default=True)
+    model_id = fields.Many2one(
+        'ir.model', string='Applies To', required=True, ondelete='cascade',
+        domain=[('model', 'in', ('crm.lead', 'res.partner', 'sale.order'))])
+    model = fields.Char(related='model_id.model', store=True, readonly=True)
+    keywords = fields.Char(
+        string='Description Keywords', required=True,
+        help="Comma-separated words that must all appear in the variable description (case-insensitive). "
+             "Separate alternatives with '|', e.g. 'agent, phone|mobile|whatsapp'.")
+    rule_type = fields.Selection([
+        ('field', 'Field Path'),
+        ('label', 'Fields Whose Label Contains'),
+    ], string='Value From', required=True, default='field')
+    field_path = fields.Char(
+        string='Field Path',
+        help="Dotted path from the record, e.g. 'partner_id.name' or 'user_id.employee_ids.work_mobile'. "
+             "The first record is used on multi-valued steps.")
+    label_keyword = fields.Char(
+        string='Label Keyword',
+        help="Values of all fields whose label contains this word are joined, e.g. 'insurance'.")
+
+    @api.constrains('rule_type', 'field_path', 'label_keyword')
+    def _check_source(self):
+        for rule in self:
+            if rule.rule_type == 'field' and not rule.field_path:
+                raise ValidationError(_("Rule '%s' needs a field path.") % rule.name)
+            if rule.rule_type == 'label' and not rule.label_keyword:
+                raise ValidationError(_("Rule '%s' needs a label keyword.") % rule.name)
+
+    # ---------- cache invalidation ----------
+    @api.model_create_multi
+    def create(self, vals_list):
+        records = super().create(vals_list)
+        self.clear_caches()
+        return records
+
+    def write(self, vals):
+        res = super().write(vals)
+        self.clear_caches()
+        return res
+
+    def unlink(self):
+        res = super().unlink()
+        self.clear_caches()
+        return res
+
+    # ---------- compiled rules ----------
+    @api.model
+    @tools.ormcache('model_name')
+    def _compiled_rules(self, model_name):
+        """Active rules of a model as plain tuples, compiled once per registry:
+        ((keyword groups), field path parts), label rules resolved to their
+        candidate field names."""
+        compiled = []
+        for rule in self.sudo().search([('model', '=', model_name)]):
+            groups = tuple(
+                tuple(alt.strip().lower() for alt in group.split('|') if alt.strip())
+                for group in rule.keywords.split(',') if group.strip()
+            )
+            if rule.rule_type == 'label':
+                paths = tuple((name,) for name in self._label_fields(model_name, rule.label_keyword.strip().lower()))
+            else:
+                paths = (tuple(part.strip() for part in rule.field_path.split('.')),)
+            compiled.append((groups, paths))
+        return tuple(compiled)
+
+    @api.model
+    @tools.ormcache('model_name', 'keyword')
+    def _label_fields(self, model_name, keyword):
+        """Names of the fields of ``model_name`` whose label contains ``keyword``."""
+        return tuple(
+            name for name, field in self.env[model_name]._fields.items()
+            if keyword in (getattr(field, 'string', '') or '').lower()
+        )
+
+    @staticmethod
+    def _match(compiled, label):
+        label = (label or '').lower()
+        for groups, paths in compiled:
+            if groups and all(any(alt in label for alt in group) for group in groups):
+                return paths
+        return None
+
+    @staticmethod
+    def _path_value(record, parts):
+        for name in parts[:-1]:
+            if name not in record._fields:
+                return ''
+            record = record[name][:1]
+            if not record:
+                return ''
+        return _display_value_for_field(record, parts[-1])
+
+    # ---------- rendering ----------
+    @api.model
+    def _prefetch_paths(self, records, paths):
+        """Warm the cache for ``paths`` on the whole recordset: one batched read
+        per path step (and one name_get per relational leaf), instead of
+        reading related records one recipient at a time."""
+        for parts in paths:
+            targets = records
+            for name in parts[:-1]:
+                if name not in targets._fields:
+                    targets = None
+                    break
+                targets = targets.mapped(name)
+            if not targets or parts[-1] not in targets._fields:
+                continue
+            leaf = targets.mapped(parts[-1])
+            if isinstance(leaf, models.BaseModel):
+                leaf.mapped('display_name')
+
+    @api.model
+    def _render_batch(self, template, records):
+        """Return {record id: [value per body variable]} for a whole recordset."""
+        compiled = self._compiled_rules(records._name) if records else ()
+        matched = [self._match(compiled, label) for label in _variable_labels(template)]
+        self._prefetch_paths(records, {parts for paths in matched if paths for parts in paths})
+        result = {}
+        for record in records:
+            values = []
+            for paths in matched:
+                value = ''
+                if paths:
+                    value = ", ".join(v for v in (self._path_value(record, parts) for parts in paths) if v)
+                values.append(value)
+            result[record.id] = values
+        return result
+
+    @api.model
+    def _render_recipients(self, template, records):
+        """Like _render_batch, but variables a record cannot fill are taken
+        from its partner (``partner_id``), rendered as one more batch."""
+        result = self._render_batch(template, records)
+        if 'partner_id' not in records._fields or all(all(values) for values in result.values()):
+            return result
+        partners = records.mapped('partner_id')
+        by_partner = self._render_batch(template, partners)
+        for record in records:
+            fallback = by_partner.get(record.partner_id.id)
+            if fallback:
+                result[record.id] = [value or other for value, other in zip(result[record.id], fallback)]
+        return result
+
+    @api.model
+    def _render(self, template, record):
+        """Return [(label, value)] for the template's body variables, filled from ``record``."""
+        labels = _variable_labels(template)
+        if not record:
+            return [(label, '') for label in labels]
+        return list(zip(labels, self._render_batch(template, record)[record.id]))
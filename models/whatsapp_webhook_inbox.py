@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+# whatsapp_meta_integration/models/whatsapp_webhook_inbox.py
+import json
+import logging
+import threading
+import time
+from datetime import timedelta
+
+import psycopg2
+
+from odoo import api, fields, models
+
+from ..tools import metrics
+
+_logger = logging.getLogger(__name__)
+
+# First key of the per-sender advisory locks, to stay clear of other modules' locks
+INBOX_LOCK_NAMESPACE = 0x5741
+
+
+class WhatsappWebhookInbox(models.Model):
+    """
+    Raw webhook events, one row per inbound message / status update.
+    The webhook only inserts here and returns; a cron does the matching.
+    Meta retries are dropped by the unique external id.
+    """
+    _name = 'whatsapp.webhook.inbox'
+    _description = 'WhatsApp Webhook Inbox'
+    _order = 'id desc'
+
+    event_type = fields.Selection([
+        ('message', 'Message'),
+        ('status', 'Status'),
+    ], string='Event', required=True, readonly=True)
+    external_id = fields.Char(
+        string='External ID', readonly=True,
+        help="WhatsApp message id, or message id and status for status updates.")
+    phone_number_id = fields.Char(string='Phone Number ID', readonly=True)
+    sender = fields.Char(string='Customer Number', readonly=True)
+    payload = fields.Text(string='Payload', readonly=True)
+    state = fields.Selection([
+        ('pending', 'Pending'),
+        ('done', 'Processed'),
+        ('error', 'Error'),
+    ], string='Status', default='pending', required=True, index=True, readonly=True)
+    error = fields.Text(string='Error', readonly=True)
+
+    _sql_constraints = [
+        ('external_id_uniq', 'unique(external_id)', 'This webhook event was already received.'),
+    ]
+
+    # ---------- intake (webhook request) ----------
+    @api.model
+    def _extract_events(self, data):
+        """Flatten a webhook payload into inbox rows (as value tuples)."""
+        rows = []
+        for entry in data.get('entry', []):
+            for change in entry.get('changes', []):
+                value = change.get('value', {})
+                phone_number_id = (value.get('metadata') or {}).get('phone_number_id')
+                for message in value.get('messages') or []:
+                    rows.append(('message', message.get('id'), phone_number_id,
+                                 message.get('from'), json.dumps(message)))
+                for status in value.get('statuses') or []:
+                    external_id = '%s:%s' % (status.get('id'), status.get('status')) if status.get('id') else None
+                    rows.append(('status', external_id, phone_number_id,
+                                 status.get('recipient_id'), json.dumps(status)))
+        return rows
+
+    @api.model
+    def _enqueue_payload(self, data):
+        """Store the events of a webhook payload with one INSERT; duplicates are ignored."""
+        rows = self._extract_events(data)
+        metrics.observe('whatsapp_webhook_events', len(rows))
+        if not rows:
+            return 0
+        values = ", ".join(["(%s, %s, %s, %s, %s, 'pending', now() at time zone 'UTC', now() at time zone 'UTC')"] * len(rows))
+        self.env.cr.execute("""
+            INSERT INTO whatsapp_webhook_inbox
+                   (event_type, external_id, phone_number_id, sender, payload, state, create_date, write_date)
+            VALUES {values}
+            ON CONFLICT (external_id) DO NOTHING
+        """.format(values=values), [item for row in rows for item in row])
+        inserted = self.env.cr.rowcount
+        if inserted < len(rows):
+            metrics.inc('whatsapp_webhook_duplicates_total', len(rows) - inserted)
+        return inserted
+
+    def action_replay(self):
+        self.write({'state': 'pending', 'error': False})
+
+    # ---------- processing (cron) ----------
+    def _process(self):
+        """Apply a batch of events; messages are resolved to leads set-wise
+        and statuses are applied to the message log in one upsert;
+        open forms of the touched leads are refreshed once per batch."""
+        Lead = self.env['crm.lead'].sudo()
+        Message = self.env['whatsapp.message'].sudo()
+        messages = [(event.phone_number_id, json.loads(event.payload)) for event in self if event.event_type == 'message']
+        statuses = [(event.phone_number_id, json.loads(event.payload)) for event in self if event.event_type == 'status']
+        if messages:
+            lead_by_sender = Lead._wa_touch_from_messages([message for _pnid, message in messages])
+            Message._log_inbound(messages, lead_by_sender)
+            # Files are only queued: downloading is left to their own cron
+            self.env['whatsapp.inbound.media'].sudo()._enqueue_messages(messages, lead_by_sender)
+            # One live refresh per lead for the whole batch
+            Lead._wa_notify_leads(lead_by_sender.values())
+        if statuses:
+            Message._apply_statuses(statuses)
+
+    def _process_one_by_one(self):
+        """Fallback when a batch failed: apply its events one at a time, so
+        a malformed event fails alone. An event hitting a transient database
+        error stays pending, and so do the later events of its sender, to
+        keep each conversation in order."""
+        held = set()
+        for event in self.sorted('id'):
+            if event.sender in held:
+                continue
+            try:
+                with self.env.cr.savepoint():
+                    event._process()
+            except psycopg2.OperationalError as e:
+                held.add(event.sender)
+                _logger.warning("WhatsApp webhook event %s left pending: %s", event.id, e)
+            except Exception as e:
+                _logger.exception("Failed to process WhatsApp webhook event %s", event.id)
+                event.write({'state': 'error', 'error': str(e)})
+            else:
+                event.write({'state': 'done', 'error': False})
+
+    @api.model
+    def _claim_batch(self, batch_size):
+        """
+        Claim pending events of whole conversations: a sender is taken only if
+        its advisory lock (held until commit) is free, and then with all its
+        pending events in order. Other runs skip that sender and work on the
+        next ones, so conversations are processed in parallel while each one
+        stays ordered.
+
+        The locks are taken after the statement's snapshot: if another run
+        committed one of these senders in between, locking its rows raises a
+        serialization error, and the caller starts over in a new transaction.
+        Locks are per sender, not per lead: two numbers of the same lead (a
+        partner's mobile and phone) may still be processed at once, and one
+        of the runs then fails on the crm_lead rows; its batch stays pending
+        and is retried by the next run.
+        """
+        cr = self.env.cr
+        cr.execute("""
+            WITH heads AS (
+                SELECT sender, min(id) AS first_id
+                  FROM whatsapp_webhook_inbox
+                 WHERE state = 'pending'
+              GROUP BY sender
+              ORDER BY first_id
+                 LIMIT %s
+            )
+            SELECT sender FROM heads
+             WHERE pg_try_advisory_xact_lock(%s, hashtext(COALESCE(sender, '')))
+        """, (batch_size, INBOX_LOCK_NAMESPACE))
+        senders = [row[0] for row in cr.fetchall()]
+        if not senders:
+            return self.browse()
+        cr.execute("""
+            SELECT id FROM whatsapp_webhook_inbox
+             WHERE state = 'pending' AND COALESCE(sender, '') = ANY(%s)
+             ORDER BY id
+             LIMIT %s
+               FOR UPDATE
+        """, ([sender or '' for sender in senders], batch_size))
+        return self.browse([row[0] for row in cr.fetchall()])
+
+    @api.model
+    def _cron_process_inbox(self, batch_size=500, max_batches=20):
+        """Process pending events; several runs (e.g. duplicated crons) may
+        work at once, see _claim_batch. Transient database errors
+        (serialization failures, lock timeouts) leave the batch pending for
+        the next run; other errors only fail the offending events."""
+        auto_commit = not getattr(threading.currentThread(), 'testing', False)
+        started = time.time()
+        for _batch in range(max_batches):
+            try:
+                events = self._claim_batch(batch_size)
+            except psycopg2.extensions.TransactionRollbackError:
+                if not auto_commit:
+                    raise
+                # Another run took some of these senders after our snapshot: release them, retry
+                self.env.cr.rollback()
+                continue
+            if not events:
+                break
+            metrics.observe('whatsapp_inbox_batch_events', len(events))
+            try:
+                with self.env.cr.savepoint(), metrics.timer('whatsapp_inbox_batch_seconds'):
+                    events._process()
+            except psycopg2.OperationalError as e:
+                # This transaction's snapshot would fail again: retry on the next run
+                _logger.warning("WhatsApp webhook events %s left pending: %s", events.ids, e)
+                if auto_commit:
+                    self.env.cr.commit()
+                break
+            except Exception:
+                _logger.exception("Failed to process WhatsApp webhook events %s, retrying one by one", events.ids)
+                events._process_one_by_one()
+            else:
+                events.write({'state': 'done', 'error': False})
+            if auto_commit:
+                self.env.cr.commit()
+        self._gc_processed()
+        metrics.observe('whatsapp_cron_seconds', time.time() - started, job='webhook_inbox')
+        self.env['whatsapp.metrics.snapshot']._flush()
+
+    @api.model
+    def _gc_processed(self):
+        """Drop processed events older than the retention (days) kept for replays."""
+        days = int(self.env['ir.config_parameter'].sudo().get_param('whatsapp_meta.inbox_retention_days', 30))
+        limit = fields.Datetime.now() - timedelta(days=days)
+        self.env.cr.execute(
+            "DELETE FROM whatsapp_webhook_inbox WHERE state = 'done' AND create_date < %s", (limit,))
@@ -8,30 +8,86 @@ FormController.include({
      * On start, check if we are on a crm.lead form and start listening.
      */
     start: function () {
+        var self = this;
+        return this._super.apply(this, arguments).then(function () {
+            if (self.modelName === 'crm.lead') {
+                self._waHandledUids = {};
+                self.call('bus_service', 'onNotification', self, self._onLeadReloadNotification);
+                self._waSubscribe();
+            }
+        });
+    },
+
+    /**
+     * Follow the lead channel of the record shown (the pager may change it).
+     */
+    update: function () {
+        var self = this;
+        return this._super.apply(this, arguments).then(function () {
+            if (self.modelName === 'crm.lead') {
+                self._waSubscribe();
+            }
+        });
+    },
+
+    destroy: function () {
+        if (this._waChannel) {
+            this.call('bus_service', 'deleteChannel', this._waChannel);
+        }
         this._super.apply(this, arguments);
-        if (this.modelName === 'crm.lead') {
-            this.call('bus_service', 'onNotification', this, this._onLeadReloadNotification);
+    },
+
+    _waSubscribe: function () {
+        var leadId = this.renderer.state.res_id;
+        var channel = leadId ? 'whatsapp_lead_' + leadId : null;
+        if (channel === this._waChannel) {
+            return;
+        }
+        if (this._waChannel) {
+            this.call('bus_service', 'deleteChannel', this._waChannel);
+        }
+        this._waChannel = channel;
+        if (channel) {
+            this.call('bus_service', 'addChannel', channel);
+            this.call('bus_service', 'startPolling');
         }
     },
 
     /**
-     * Handles the reload notification from the server.
+     * Handles the update notification from the server: only the WhatsApp
+     * fields and, after a send, the chatter messages are read again; the
+     * chatter then fetches the new messages only.
      * @param {Array} notifications - The list of notifications from the bus.
      */
     _onLeadReloadNotification: function (notifications) {
         var self = this;
         notifications.forEach(function (notification) {
-            // Check if the notification is on our custom 'lead_reload' channel
-            if (notification[0] && notification[0][1] === 'lead_reload') {
-                var leadId = notification[1].lead_id;
-                // Check if the notification is for the lead we are currently viewing
-                if (self.renderer.state.res_id === leadId) {
-                    console.log('WhatsApp Integration: Reloading lead view for ID ' + leadId);
-                    self.reload();
-                }
+            var message = notification[1];
+            if (!message || message.type !== 'whatsapp_lead_update') {
+                return;
+            }
+            // The same update is sent on the lead channel and to followers
+            if (self._waHandledUids[message.uid]) {
+                return;
+            }
+            self._waHandledUids[message.uid] = true;
+            // Check if the notification is for the lead we are currently viewing
+            if (self.renderer.state.res_id !== message.lead_id || self.model.isDirty(self.handle)) {
+                return;
+            }
+            var fieldNames = message.fields.slice();
+            if (message.chatter) {
+                fieldNames.push('message_ids');
+            }
+            // Only the fields this form view actually shows
+            fieldNames = fieldNames.filter(function (name) {
+                return name in self.renderer.state.data;
+            });
+            if (fieldNames.length) {
+                self.reload({fieldNames: fieldNames});
             }
         });
     },
 });
 
-});
\ No newline at end of file
+});
@@ -0,0 +1,2 @@
+# whatsapp_meta_integration/tests/__init__.py
+from . import test_send_wizard
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# whatsapp_meta_integration/tests/test_send_wizard.py
+import json
+
+from odoo.tests import common, tagged
+
+
+@tagged('post_install', '-at_install')
+class TestSendWizardButtons(common.TransactionCase):
+    """The wizards are saved from the onchange values the way the web client
+    does (Form drops readonly fields), so dynamic button lines must survive it."""
+
+    def setUp(self):
+        super().setUp()
+        self.env['whatsapp.account'].create({
+            'name': 'Test',
+            'access_token': 'token',
+            'phone_number_id': 'test-phone-number-id',
+        })
+        self.template = self.env['whatsapp.template'].create({
+            'name': 'order_tracking',
+            'language_code': 'en_US',
+            'parameter_format': 'POSITIONAL',
+            'components_json': json.dumps([
+                {'type': 'BODY', 'text': 'Your order has shipped.'},
+                {'type': 'BUTTONS', 'buttons': [
+                    {'type': 'URL', 'text': 'Track', 'url': 'https://example.com/track/{{1}}',
+                     'example': ['https://example.com/track/ABC123']},
+                ]},
+            ]),
+        })
+        self.partner = self.env['res.partner'].create({'name': 'Customer', 'mobile': '+201001234567'})
+
+    def _last_payload(self):
+        message = self.env['whatsapp.outbox'].search([('template_id', '=', self.template.id)], limit=1)
+        self.assertTrue(message, "The template send should be queued")
+        return json.loads(message.payload)
+
+    def test_send_button_template(self):
+        wizard_form = common.Form(self.env['send.whatsapp.wizard'].with_context(
+            active_model='res.partner', active_id=self.partner.id))
+        wizard_form.template_id = self.template
+        with wizard_form.variable_ids.edit(0) as line:
+            line.value = 'XYZ789'
+        wizard_form.save().action_send_message()
+
+        button = next(c for c in self._last_payload()['template']['components'] if c['type'] == 'button')
+        self.assertEqual(button['index'], '0')
+        self.assertEqual(button['parameters'], [{'type': 'text', 'text': 'XYZ789'}])
+
+    def test_broadcast_button_template(self):
+        wizard_form = common.Form(self.env['whatsapp.broadcast.wizard'].with_context(
+            active_model='res.partner', active_ids=self.partner.ids))
+        wizard_form.template_id = self.template
+        with wizard_form.variable_ids.edit(0) as line:
+            line.value = 'XYZ789'
+        wizard_form.save().action_broadcast()
+
+        button = next(c for c in self._last_payload()['template']['components'] if c['type'] == 'button')
+        self.assertEqual(button['parameters'], [{'type': 'text', 'text': 'XYZ789'}])
@@ -0,0 +1,4 @@
+# whatsapp_meta_integration/tools/__init__.py
+from . import graph_client
+from . import metrics
+from . import phone
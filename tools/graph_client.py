@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+# whatsapp_meta_integration/tools/graph_client.py
+"""
+Thin client for the WhatsApp Cloud (Graph) API.
+
+Every process keeps one pooled ``requests.Session`` per access token, so
+consecutive calls for the same account reuse the same keep-alive TCP/TLS
+connection to graph.facebook.com instead of handshaking on every request.
+"""
+import hashlib
+import io
+import logging
+import os
+import threading
+import time
+import uuid
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import metrics
+
+_logger = logging.getLogger(__name__)
+
+GRAPH_URL = 'https://graph.facebook.com'
+DEFAULT_API_VERSION = 'v19.0'
+DEFAULT_TIMEOUT = 60
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+# Throughput (130429) and per-recipient pair rate (131056) limits come back
+# as HTTP 400 but must be retried later, not treated as hard failures.
+RETRYABLE_CODES = (130429, 131056)
+
+STREAM_CHUNK_SIZE = 64 * 1024
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class WhatsAppApiError(Exception):
+    """Error returned by (or while reaching) the Graph API.
+
+    ``retryable`` is set for throttling, transient server errors and network
+    failures, i.e. the cases where the same call may succeed later.
+    """
+
+    def __init__(self, message, status_code=None, code=None, retryable=False):
+        super().__init__(message)
+        self.status_code = status_code
+        self.code = code
+        self.retryable = retryable
+
+
+def _get_session(key):
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=0)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[key] = session
+        return session
+
+
+def _endpoint(url):
+    """Low-cardinality metric label for a Graph API URL."""
+    parts = url.split('?', 1)[0].rstrip('/').split('/')
+    if parts[-1] in ('messages', 'media', 'message_templates'):
+        return parts[-1]
+    return 'media_info'
+
+
+def _error_from_response(response):
+    code = None
+    try:
+        err = response.json().get('error', {})
+    except ValueError:
+        message = response.text
+    else:
+        code = err.get('code')
+        message = err.get('message') or response.text
+        details = (err.get('error_data') or {}).get('details')
+        if details:
+            message = "%s\n\nDetails: %s" % (message, details)
+    return WhatsAppApiError(
+        message,
+        status_code=response.status_code,
+        code=code,
+        retryable=response.status_code in RETRYABLE_STATUS or code in RETRYABLE_CODES,
+    )
+
+
+class MultipartFileStream(object):
+    """
+    multipart/form-data body that streams a file from disk.
+
+    Only the small multipart head and tail live in memory; the file itself is
+    read in chunks while the request is sent. The total length is known up
+    front, so requests sends a regular Content-Length instead of chunking.
+    """
+
+    def __init__(self, fileobj, size, filename, mimetype, fields=None):
+        boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary=%s' % boundary
+        head = b''
+        for name, value in (fields or {}).items():
+            head += ('--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n'
+                     % (boundary, name, value)).encode()
+        head += ('--%s\r\nContent-Disposition: form-data; name="file"; filename="%s"\r\n'
+                 'Content-Type: %s\r\n\r\n' % (boundary, filename.replace('"', '%22'), mimetype)).encode()
+        tail = ('\r\n--%s--\r\n' % boundary).encode()
+        self._parts = [io.BytesIO(head), fileobj, io.BytesIO(tail)]
+        self.len = len(head) + size + len(tail)
+
+    def __len__(self):
+        return self.len
+
+    def read(self, size=-1):
+        chunks = []
+        while self._parts and (size < 0 or size > 0):
+            chunk = self._parts[0].read(size)
+            if not chunk:
+                self._parts.pop(0)
+                continue
+            chunks.append(chunk)
+            if size > 0:
+                size -= len(chunk)
+        return b''.join(chunks)
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(STREAM_CHUNK_SIZE)
+            if not chunk:
+                return
+            yield chunk
+
+
+class GraphClient(object):
+
+    def __init__(self, access_token, phone_number_id=None, waba_id=None,
+                 api_version=None, timeout=DEFAULT_TIMEOUT, base_url=None):
+        self.base_url = (base_url or GRAPH_URL).rstrip('/')
+        self.access_token = access_token
+        self.phone_number_id = phone_number_id
+        self.waba_id = waba_id
+        self.api_version = api_version or DEFAULT_API_VERSION
+        self.timeout = timeout
+        self.session = _get_session(access_token)
+
+    # ---------- plumbing ----------
+    def url(self, *parts):
+        return '/'.join([self.base_url, self.api_version] + [str(p).strip('/') for p in parts])
+
+    def request(self, method, url, **kwargs):
+        """Call the API and return the decoded JSON body, raising WhatsAppApiError on failure."""
+        headers = dict(kwargs.pop('headers', None) or {})
+        headers['Authorization'] = 'Bearer %s' % self.access_token
+        kwargs.setdefault('timeout', self.timeout)
+        endpoint = _endpoint(url)
+        with metrics.timer('whatsapp_graph_request_seconds', endpoint=endpoint) as labels:
+            labels['status'] = 'network_error'
+            try:
+                response = self.session.request(method, url, headers=headers, **kwargs)
+            except requests.exceptions.RequestException as e:
+                metrics.inc('whatsapp_graph_errors_total', endpoint=endpoint, code='network')
+                raise WhatsAppApiError(str(e), retryable=True)
+            labels['status'] = response.status_code
+        if response.status_code >= 400:
+            error = _error_from_response(response)
+            metrics.inc('whatsapp_graph_errors_total', endpoint=endpoint, code=error.code or response.status_code)
+            _logger.error("WhatsApp API %s %s failed (%s): %s", method, url, response.status_code, error)
+            raise error
+        try:
+            return response.json()
+        except ValueError:
+            raise WhatsAppApiError("Non-JSON response from WhatsApp: %s" % response.text[:500],
+                                   status_code=response.status_code)
+
+    # ---------- messages ----------
+    def send_message(self, payload):
+        """POST a /messages payload; return the WhatsApp message id (wamid)."""
+        result = self.request('POST', self.url(self.phone_number_id, 'messages'), json=payload)
+        return ((result.get('messages') or [{}])[0]).get('id') or ''
+
+    def upload_media(self, filename, mimetype, path=None, content=None):
+        """
+        Upload a file to the phone number's media store; return the media id.
+        Pass ``path`` to stream the file from disk, or ``content`` (bytes).
+        """
+        url = self.url(self.phone_number_id, 'media')
+        if path:
+            with open(path, 'rb') as fileobj:
+                body = MultipartFileStream(fileobj, os.fstat(fileobj.fileno()).st_size, filename, mimetype,
+                                           fields={'messaging_product': 'whatsapp'})
+                result = self.request('POST', url, data=body, headers={'Content-Type': body.content_type})
+        else:
+            result = self.request('POST', url,
+                                  files={'file': (filename, content, mimetype)},
+                                  data={'messaging_product': 'whatsapp'})
+        if 'id' not in result:
+            raise WhatsAppApiError("Failed to upload media to WhatsApp:\n%s" % result)
+        return result['id']
+
+    def download_media(self, media_id, fileobj, max_bytes=None):
+        """
+        Stream an inbound media file into ``fileobj``, chunk by chunk, hashing
+        it on the way. Returns {mimetype, size, sha1, sha256}.
+        """
+        info = self.request('GET', self.url(media_id))
+        if not info.get('url'):
+            raise WhatsAppApiError("No download URL for media %s:\n%s" % (media_id, info))
+        if max_bytes and int(info.get('file_size') or 0) > max_bytes:
+            raise WhatsAppApiError("Media %s is too large to download (%s bytes)." % (media_id, info['file_size']))
+        started = time.time()
+        try:
+            response = self.session.get(info['url'], headers={'Authorization': 'Bearer %s' % self.access_token},
+                                        stream=True, timeout=self.timeout)
+        except requests.exceptions.RequestException as e:
+            metrics.inc('whatsapp_graph_errors_total', endpoint='download', code='network')
+            raise WhatsAppApiError(str(e), retryable=True)
+        with response:
+            if response.status_code >= 400:
+                raise _error_from_response(response)
+            sha1, sha256, size = hashlib.sha1(), hashlib.sha256(), 0
+            try:
+                for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+                    size += len(chunk)
+                    if max_bytes and size > max_bytes:
+                        raise WhatsAppApiError("Media %s is too large to download." % media_id)
+                    sha1.update(chunk)
+                    sha256.update(chunk)
+                    fileobj.write(chunk)
+            except requests.exceptions.RequestException as e:
+                raise WhatsAppApiError(str(e), retryable=True)
+            finally:
+                metrics.observe('whatsapp_graph_request_seconds', time.time() - started,
+                                endpoint='download', status=response.status_code)
+        return {'mimetype': info.get('mime_type'), 'size': size,
+                'sha1': sha1.hexdigest(), 'sha256': sha256.hexdigest()}
+
+    # ---------- templates ----------
+    def iter_templates(self, fields='id,name,language,status,components,parameter_format', limit=200):
+        """Yield every message template of the WABA, following the paging cursors."""
+        url = self.url(self.waba_id, 'message_templates')
+        params = {'fields': fields, 'limit': limit}
+        while url:
+            result = self.request('GET', url, params=params)
+            for template in result.get('data', []):
+                yield template
+            # ``paging.next`` is a complete URL, query string included
+            url = (result.get('paging') or {}).get('next')
+            params = None
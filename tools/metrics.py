@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# whatsapp_meta_integration/tools/metrics.py
+"""
+In-process counters and histograms for the module's hot paths, rendered in
+the Prometheus text format. Recording is a dict update under a lock; each
+process periodically stores its totals (whatsapp.metrics.snapshot) so that
+the metrics endpoint can add up the HTTP workers and the cron worker.
+"""
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+COUNT_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+_lock = threading.Lock()
+_declared = {}
+_counters = {}
+_histograms = {}
+
+
+def process_key():
+    """Snapshot key of the current process. Not computed at import: the
+    prefork server may load the module in its master, before forking the
+    HTTP and cron workers."""
+    return '%s:%s' % (socket.gethostname(), os.getpid())
+
+
+def _reset_after_fork():
+    global _lock
+    _lock = threading.Lock()
+    _counters.clear()
+    _histograms.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    # Workers start from zero rather than from the totals the master recorded
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _declare(name, kind, help_text, buckets=None):
+    _declared[name] = (kind, help_text, buckets)
+
+
+_declare('whatsapp_graph_request_seconds', 'histogram',
+         "Graph API call duration by endpoint and HTTP status.", TIME_BUCKETS)
+_declare('whatsapp_graph_errors_total', 'counter', "Graph API errors by endpoint and Meta error code.")
+_declare('whatsapp_outbox_messages_total', 'counter', "Outbound messages by final result.")
+_declare('whatsapp_outbox_retries_total', 'counter', "Outbound sends rescheduled after a retryable error.")
+_declare('whatsapp_outbox_duplicates_total', 'counter', "Interactive sends dropped as duplicates of a queued message.")
+_declare('whatsapp_webhook_payload_bytes', 'histogram', "Size of received webhook payloads.", SIZE_BUCKETS)
+_declare('whatsapp_webhook_events', 'histogram', "Events (messages and statuses) per webhook payload.", COUNT_BUCKETS)
+_declare('whatsapp_webhook_duplicates_total', 'counter', "Webhook events dropped as already received.")
+_declare('whatsapp_webhook_seconds', 'histogram', "Webhook request handling time.", TIME_BUCKETS)
+_declare('whatsapp_inbox_batch_events', 'histogram', "Webhook events per processed inbox batch.", COUNT_BUCKETS)
+_declare('whatsapp_inbox_batch_seconds', 'histogram', "Processing time (mostly SQL) per inbox batch.", TIME_BUCKETS)
+_declare('whatsapp_lead_matches_total', 'counter', "Inbound senders by lead match strategy.")
+_declare('whatsapp_lead_match_seconds', 'histogram', "SQL time to match a batch of senders to leads.", TIME_BUCKETS)
+_declare('whatsapp_template_sync_seconds', 'histogram', "Template sync duration.", TIME_BUCKETS)
+_declare('whatsapp_template_sync_templates_total', 'counter', "Synced templates by outcome.")
+_declare('whatsapp_report_cache_total', 'counter', "Sale order PDF lookups by outcome (hit: no rendering).")
+_declare('whatsapp_report_render_seconds', 'histogram', "Sale order PDF rendering time.", TIME_BUCKETS)
+_declare('whatsapp_cron_seconds', 'histogram', "Duration of the module's cron runs.", TIME_BUCKETS)
+
+
+def _key(name, labels):
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    buckets = _declared[name][2]
+    key = _key(name, labels)
+    with _lock:
+        # [count per bucket..., +Inf count, sum]
+        data = _histograms.get(key)
+        if data is None:
+            data = _histograms[key] = [0] * (len(buckets) + 2)
+        for index, bound in enumerate(buckets):
+            if value <= bound:
+                data[index] += 1
+        data[-2] += 1
+        data[-1] += value
+
+
+@contextmanager
+def timer(name, **labels):
+    started = time.time()
+    try:
+        yield labels  # callers may still add labels, e.g. the outcome
+    finally:
+        observe(name, time.time() - started, **labels)
+
+
+# ---------- export ----------
+def snapshot():
+    """This process' totals as a JSON-serializable dict."""
+    with _lock:
+        return {
+            'counters': [[name, list(labels), value] for (name, labels), value in _counters.items()],
+            'histograms': [[name, list(labels), list(data)] for (name, labels), data in _histograms.items()],
+        }
+
+
+def merge(snapshots):
+    counters, histograms = {}, {}
+    for snap in snapshots:
+        for name, labels, value in snap.get('counters', []):
+            key = (name, tuple(tuple(label) for label in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, data in snap.get('histograms', []):
+            key = (name, tuple(tuple(label) for label in labels))
+            if key in histograms and len(histograms[key]) == len(data):
+                histograms[key] = [a + b for a, b in zip(histograms[key], data)]
+            else:
+                histograms[key] = list(data)
+    return counters, histograms
+
+
+def _labels_text(labels, extra=()):
+    items = list(labels) + list(extra)
+    if not items:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in items)
+
+
+def render(snapshots):
+    """Prometheus text exposition of the sum of ``snapshots``."""
+    counters, histograms = merge(snapshots)
+    lines = []
+    for name in sorted(_declared):
+        kind, help_text, buckets = _declared[name]
+        series = counters if kind == 'counter' else histograms
+        keys = sorted(key for key in series if key[0] == name)
+        if not keys:
+            continue
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for key in keys:
+            labels = key[1]
+            if kind == 'counter':
+                lines.append('%s%s %s' % (name, _labels_text(labels), series[key]))
+                continue
+            data = series[key]
+            for bound, count in zip(buckets, data):
+                lines.append('%s_bucket%s %s' % (name, _labels_text(labels, [('le', bound)]), count))
+            lines.append('%s_bucket%s %s' % (name, _labels_text(labels, [('le', '+Inf')]), data[-2]))
+            lines.append('%s_count%s %s' % (name, _labels_text(labels), data[-2]))
+            lines.append('%s_sum%s %s' % (name, _labels_text(labels), data[-1]))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# whatsapp_meta_integration/tools/phone.py
+import re
+
+# Matching is done on the last digits of a number, so "+20 10 1234 5678",
+# "01012345678" and "201012345678" all resolve to the same key.
+PHONE_KEY_DIGITS = 10
+PHONE_KEY_MIN_DIGITS = 7
+
+
+def phone_key(number):
+    """Return the digits-only suffix used to match phone numbers, or False.
+    Only ASCII digits are kept, as in ``phone_key_sql``: \\D would keep
+    other scripts' digits (e.g. Arabic-Indic) that the SQL backfill drops."""
+    digits = re.sub(r'[^0-9]', '', number or '')
+    if len(digits) < PHONE_KEY_MIN_DIGITS:
+        return False
+    return digits[-PHONE_KEY_DIGITS:]
+
+
+def phone_key_sql(column):
+    """SQL expression computing ``phone_key`` for ``column`` (used for bulk backfills)."""
+    digits = "regexp_replace({col}, '[^0-9]', '', 'g')".format(col=column)
+    return "CASE WHEN length({digits}) >= {min} THEN right({digits}, {n}) END".format(
+        digits=digits, min=PHONE_KEY_MIN_DIGITS, n=PHONE_KEY_DIGITS)
@@ -1,4 +1,5 @@
 # whatsapp_meta_integration/wizard/__init__.py
 from . import send_whatsapp_wizard
 from . import whatsapp_variable_input
-from . import reply_whatsapp_wizard
\ No newline at end of file
+from . import reply_whatsapp_wizard
+from . import whatsapp_broadcast_wizard
\ No newline at end of file
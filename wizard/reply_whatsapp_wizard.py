@@ -1,14 +1,13 @@
 # -*- coding: utf-8 -*-
-import base64
-import json
 import logging
 import mimetypes
 import re
-import requests
 
 from odoo import api, fields, models, _
 from odoo.exceptions import UserError
 
+from ..models.whatsapp_outbox import MAX_MEDIA_BYTES
+
 # Safe HTML escape (v13-friendly import)
 try:
     from odoo.tools.misc import html_escape
@@ -63,45 +62,6 @@ class WhatsappReplyWizard(models.TransientModel):
             vals['window_ok'] = getattr(lead, 'reply_window_open', False)
         return vals
 
-    # ---------- config ----------
-    def _wa_get_credentials(self):
-        ICP = self.env['ir.config_parameter'].sudo()
-        access_token = ICP.get_param('whatsapp.access_token') or ''
-        phone_number_id = ICP.get_param('whatsapp.phone_number_id') or ''
-        api_version = ICP.get_param('whatsapp.api_version') or 'v21.0'
-        if not access_token or not phone_number_id:
-            raise UserError(_("WhatsApp access token / phone number ID are not configured."))
-        return api_version, access_token, phone_number_id
-
-    # ---------- helpers: upload + send ----------
-    def _wa_upload_media(self, token, phone_number_id, attachment, api_version='v21.0'):
-        """Upload an ir.attachment to WA; return (media_id, mimetype, filename)."""
-        filename = attachment.name or 'file'
-        mimetype = attachment.mimetype or (mimetypes.guess_type(filename)[0] or 'application/octet-stream')
-        raw = base64.b64decode(attachment.datas or b'')
-
-        max_bytes = 100 * 1024 * 1024
-        if len(raw) > max_bytes:
-            raise UserError(_("File %s is too large to send (>%s MB).") % (filename, 100))
-
-        url = 'https://graph.facebook.com/{ver}/{pnid}/media'.format(ver=api_version, pnid=phone_number_id)
-        headers = {'Authorization': 'Bearer %s' % token}
-        files = {'file': (filename, raw, mimetype)}
-        data = {'messaging_product': 'whatsapp'}
-
-        r = requests.post(url, headers=headers, files=files, data=data, timeout=60)
-        # Expect JSON always
-        try:
-            result = r.json()
-        except Exception:
-            _logger.exception("WhatsApp upload error (non-JSON)")
-            raise UserError(_("Failed to upload media to WhatsApp (non-JSON response)."))
-
-        if r.status_code >= 400 or 'id' not in result:
-            _logger.error("WhatsApp upload failed: %s", result)
-            raise UserError(_("Failed to upload media to WhatsApp:\n%s") % result)
-        return result['id'], mimetype, filename
-
     @staticmethod
     def _wa_type_from_mimetype(mimetype):
         if mimetype.startswith('image/'):
@@ -112,39 +72,6 @@ class WhatsappReplyWizard(models.TransientModel):
             return 'audio'
         return 'document'
 
-    def _wa_send_text(self, token, phone_number_id, api_version, to_e164, body):
-        url = 'https://graph.facebook.com/{ver}/{pnid}/messages'.format(ver=api_version, pnid=phone_number_id)
-        headers = {'Authorization': 'Bearer %s' % token, 'Content-Type': 'application/json'}
-        payload = {
-            "messaging_product": "whatsapp",
-            "to": to_e164,
-            "type": "text",
-            "text": {"preview_url": False, "body": body or ""}
-        }
-        r = requests.post(url, headers=headers, json=payload, timeout=60)
-        if r.status_code >= 400:
-            _logger.error("WhatsApp text send failed: %s", r.text)
-            raise UserError(_("Failed to send text message:\n%s") % r.text)
-
-    def _wa_send_media(self, token, phone_number_id, api_version, to_e164, media_id, wa_type, caption=None, filename=None):
-        url = 'https://graph.facebook.com/{ver}/{pnid}/messages'.format(ver=api_version, pnid=phone_number_id)
-        headers = {'Authorization': 'Bearer %s' % token, 'Content-Type': 'application/json'}
-        block = {"id": media_id}
-        if caption:
-            block["caption"] = caption
-        if wa_type == 'document' and filename:
-            block["filename"] = filename
-        payload = {
-            "messaging_product": "whatsapp",
-            "to": to_e164,
-            "type": wa_type,
-            wa_type: block
-        }
-        r = requests.post(url, headers=headers, json=payload, timeout=60)
-        if r.status_code >= 400:
-            _logger.error("WhatsApp media send failed: %s", r.text)
-            raise UserError(_("Failed to send media message:\n%s") % r.text)
-
     # ---------- main action ----------
     def action_send(self):
         self.ensure_one()
@@ -156,43 +83,52 @@ class WhatsappReplyWizard(models.TransientModel):
         if not to or not to.startswith('+'):
             raise UserError(_("Destination number must be E.164 (e.g. +201234567890)."))
 
-        api_version, access_token, phone_number_id = self._wa_get_credentials()
+        Outbox = self.env['whatsapp.outbox']
+        header = _("✅ Sent via WhatsApp to <b>%s</b>") % to
+        account = self.env['whatsapp.account']._route(self.lead_id)
+        common = {'to_number': to, 'account_id': account.id, 'res_model': 'crm.lead', 'res_id': self.lead_id.id}
+        vals_list = []
 
         # 1) Text (if provided)
         msg = (self.message or '').strip()
         if msg:
-            self._wa_send_text(access_token, phone_number_id, api_version, to, msg)
-
-        # 2) Media (each attachment)
-        sent_any_media = False
+            safe = html_escape(msg).replace('\n', '<br/>')
+            vals_list.append(dict(common, **{
+                'message_type': 'text',
+                'payload': {
+                    "messaging_product": "whatsapp",
+                    "to": to,
+                    "type": "text",
+                    "text": {"preview_url": False, "body": msg},
+                },
+                'log_body': header + "<div style='margin-top:6px'><i>Message:</i><br/>%s</div>" % safe,
+            }))
+
+        # 2) Media (each attachment); the upload itself happens in the outbox cron
         for att in self.attachment_ids:
-            media_id, mimetype, filename = self._wa_upload_media(access_token, phone_number_id, att, api_version=api_version)
+            filename = att.name or 'file'
+            if att.file_size > MAX_MEDIA_BYTES:
+                raise UserError(_("File %s is too large to send (>%s MB).") % (filename, 100))
+            mimetype = att.mimetype or (mimetypes.guess_type(filename)[0] or 'application/octet-stream')
             wa_type = self._wa_type_from_mimetype(mimetype)
-            # (Optional) use caption=msg for the first media:
-            # caption_to_use = msg if not sent_any_media and msg else None
-            caption_to_use = None
-            self._wa_send_media(
-                access_token, phone_number_id, api_version,
-                to, media_id, wa_type, caption=caption_to_use, filename=filename
-            )
-            sent_any_media = True
-
-        # ---------- Log full details to chatter (actual text + attachment names) ----------
-        parts = [ _("✅ Sent via WhatsApp to <b>%s</b>") % to ]
-
-        if msg:
-            safe = html_escape(msg).replace('\n', '<br/>')
-            parts.append("<div style='margin-top:6px'><i>Message:</i><br/>%s</div>" % safe)
-
-        if self.attachment_ids:
-            names = ", ".join(html_escape(a.name or "file") for a in self.attachment_ids)
-            parts.append("<div><i>Attachments:</i> %s</div>" % names)
-
-        self.lead_id.message_post(
-            body="<br/>".join(parts),
-            message_type='comment',
-            subtype_xmlid='mail.mt_note',
-        )
+            block = {}
+            if wa_type == 'document':
+                block['filename'] = filename
+            vals_list.append(dict(common, **{
+                'message_type': 'media',
+                'attachment_id': att.id,
+                'payload': {
+                    "messaging_product": "whatsapp",
+                    "to": to,
+                    "type": wa_type,
+                    wa_type: block,
+                },
+                'log_body': header + "<div><i>Attachments:</i> %s</div>" % html_escape(filename),
+            }))
+
+        if not vals_list:
+            raise UserError(_("Type a message or add an attachment to send."))
+        # Double-clicks and client retries within the dedupe window send nothing more
+        Outbox._enqueue(vals_list, dedupe=True)
 
         return {'type': 'ir.actions.act_window_close'}
-
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+# whatsapp_meta_integration/wizard/whatsapp_broadcast_wizard.py
+import json
+import logging
+
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError
+
+from ..models.whatsapp_variable_rule import _variable_labels
+from .send_whatsapp_wizard import _normalize_e164_no_country
+
+_logger = logging.getLogger(__name__)
+
+BROADCAST_MODELS = ('crm.lead', 'res.partner', 'sale.order')
+ENQUEUE_CHUNK = 1000
+
+
+class WhatsappBroadcastWizard(models.TransientModel):
+    _name = 'whatsapp.broadcast.wizard'
+    _description = 'Send WhatsApp Template to Many Recipients'
+
+    res_model = fields.Char(string="Model", readonly=True)
+    res_ids = fields.Text(string="Record IDs", readonly=True)
+    recipient_count = fields.Integer(string="Selected Records", compute='_compute_recipient_count')
+    template_id = fields.Many2one('whatsapp.template', string="Template", required=True)
+    has_header_variable = fields.Boolean(related='template_id.has_header_variable')
+    header_variable_value = fields.Char(string="Header Variable")
+    header_variable_description = fields.Char(related='template_id.header_variable_description', readonly=True)
+    header_type = fields.Char(related='template_id.header_type')
+    variable_ids = fields.One2many(
+        'whatsapp.broadcast.variable', 'wizard_id', string="Body Variables",
+        help="Leave a value empty to fill it per recipient from the record."
+    )
+
+    @api.model
+    def default_get(self, fields_list):
+        vals = super().default_get(fields_list)
+        active_model = self.env.context.get('active_model')
+        active_ids = self.env.context.get('active_ids') or []
+        if active_model not in BROADCAST_MODELS:
+            raise UserError(_("WhatsApp broadcasts can only be sent from leads, contacts or sales orders."))
+        vals['res_model'] = active_model
+        vals['res_ids'] = json.dumps(active_ids)
+        return vals
+
+    @api.depends('res_ids')
+    def _compute_recipient_count(self):
+        for wizard in self:
+            wizard.recipient_count = len(json.loads(wizard.res_ids or '[]'))
+
+    @api.onchange('template_id')
+    def _onchange_template_id(self):
+        self.variable_ids = [(5, 0, 0)]
+        if not self.template_id:
+            return
+        lines = []
+        if self.template_id.variable_count:
+            lines = [
+                (0, 0, {'sequence': i, 'name': label})
+                for i, label in enumerate(_variable_labels(self.template_id), start=1)
+            ]
+        lines += [
+            (0, 0, {'sequence': len(lines) + 1 + i, 'name': label, 'is_button': True, 'button_index': index})
+            for i, (index, label) in enumerate(self.template_id._button_slots())
+        ]
+        self.variable_ids = lines
+
+    # ---------- recipients ----------
+    def _recipient_number(self, record):
+        """Raw phone number to send to for a selected record."""
+        partner = record if record._name == 'res.partner' else record.partner_id
+        number = (partner.mobile or partner.phone) if partner else ''
+        if record._name == 'crm.lead':
+            number = number or record.mobile or record.phone
+        return number or ''
+
+    def action_broadcast(self):
+        self.ensure_one()
+        Outbox = self.env['whatsapp.outbox']
+        Account = self.env['whatsapp.account']
+        if self.has_header_variable and not self.header_variable_value:
+            raise UserError(_("Please provide a value for the Header Variable."))
+
+        variables = self.variable_ids.sorted(key=lambda r: r.sequence or 0)
+        buttons = variables.filtered('is_button')
+        if any(not button.value for button in buttons):
+            raise UserError(_("Dynamic buttons cannot be filled per recipient: please provide their values."))
+        button_values = {button.button_index: button.value for button in buttons}
+        static_values = (variables - buttons).mapped('value')
+        records = self.env[self.res_model].browse(json.loads(self.res_ids or '[]')).exists()
+
+        auto_by_record = {}
+        if not all(static_values):
+            auto_by_record = self.env['whatsapp.variable.rule']._render_recipients(self.template_id, records)
+
+        vals_list, seen = [], set()
+        queued = skipped = 0
+        for record in records:
+            number = self._recipient_number(record)
+            try:
+                to_e164 = _normalize_e164_no_country(number)
+            except UserError:
+                skipped += 1
+                continue
+            if to_e164 in seen:
+                skipped += 1
+                continue
+            seen.add(to_e164)
+
+            body_values = list(static_values)
+            if not all(body_values):
+                body_values = [static or auto for static, auto in zip(body_values, auto_by_record[record.id])]
+            if not all(body_values):
+                _logger.info("WhatsApp broadcast: skipping %s, missing variable values", record)
+                skipped += 1
+                continue
+
+            vals_list.append({
+                'message_type': 'template',
+                'template_id': self.template_id.id,
+                'to_number': to_e164,
+                'account_id': Account._route(record).id,
+                'payload': self.template_id._build_send_payload(to_e164, self.header_variable_value, body_values,
+                                                                button_values=button_values),
+                'res_model': record._name,
+                'res_id': record.id,
+                'log_body': _("Sent WhatsApp Template: <b>%s</b> to <b>%s</b>") % (self.template_id.name, to_e164),
+            })
+            if len(vals_list) >= ENQUEUE_CHUNK:
+                Outbox._enqueue(vals_list)
+                queued += len(vals_list)
+                vals_list = []
+        if vals_list:
+            Outbox._enqueue(vals_list)
+            queued += len(vals_list)
+
+        message = _('%s messages queued, %s recipients skipped (no valid number, duplicate or missing values).') % (queued, skipped)
+        return {
+            'type': 'ir.actions.client', 'tag': 'display_notification',
+            'params': {'title': _('WhatsApp Broadcast'), 'message': message, 'type': 'success', 'sticky': False}
+        }
+
+
+class WhatsappBroadcastVariable(models.TransientModel):
+    _name = 'whatsapp.broadcast.variable'
+    _description = 'WhatsApp Broadcast Variable'
+    _order = 'sequence'
+
+    wizard_id = fields.Many2one('whatsapp.broadcast.wizard', required=True, ondelete='cascade')
+    sequence = fields.Integer(required=True)
+    name = fields.Char(string="Variable", readonly=True)
+    value = fields.Char(string="Value", help="Same value for every recipient. Leave empty to auto-fill per recipient.")
+    is_button = fields.Boolean()
+    button_index = fields.Integer()
@@ -10,4 +10,6 @@ class WhatsappVariableInput(models.TransientModel):
     wizard_id = fields.Many2one('send.whatsapp.wizard', required=True, ondelete='cascade')
     sequence = fields.Integer(required=True)
     name = fields.Char(string="Variable", readonly=True)
-    value = fields.Char(string="Value", required=True)
\ No newline at end of file
+    value = fields.Char(string="Value", required=True)
+    is_button = fields.Boolean()
+    button_index = fields.Integer()
\ No newline at end of file